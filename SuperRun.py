@@ -1,8 +1,25 @@
 import os
 import sys
+import gc
 import random
 import math
+import mmap
+import struct
+import time
+import atexit
+import queue
+import argparse
+import subprocess
+import threading
+import tracemalloc
+import weakref
+from multiprocessing import shared_memory
+from collections import namedtuple, deque, defaultdict
 import pygame as pg
+try:
+    from pygame._sdl2 import video as sdl2_video  # Renderer/Texture 描画（--backend texture）
+except ImportError:
+    sdl2_video = None
 
 
 # =========================
@@ -10,7 +27,7 @@ import pygame as pg
 # =========================
 WIDTH = 1100     # 画面幅
 HEIGHT = 650     # 画面高さ
-os.chdir(os.path.dirname(os.path.abspath(__file__)))  # fig参照のため
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # fig やラン記録の置き場所
 
 FPS = 60
 
@@ -60,6 +77,14 @@ LIFE_INIT = 3
 
 # ランダムイベントのリスト
 EVENT_LST = ["speed_up", "speed_down"]
+EVENT_INTERVAL_MS = 40000     # ランダムイベントの発生間隔（ミリ秒）
+EVENT_DURATION_MS = 10000     # イベントの継続時間（ミリ秒）
+EVENT_SPEED_UP = 1.5          # speed_up のときの速度倍率
+EVENT_SPEED_DOWN = 0.8        # speed_down のときの速度倍率
+
+# 🍄（残機+1）の出現チャンス
+BONUS_INTERVAL_MS = 1000      # 抽選間隔（ミリ秒）
+BONUS_CHANCE = 0.2            # 1回の抽選で出る確率
 
 # アイテム関係
 STAR_DURATION_MS = 4000       # スター効果持続時間（ミリ秒）
@@ -69,10 +94,83 @@ STAR_BLINK_INTERVAL = 5       # 点滅間隔（フレーム）
 # 足場タイプの横のび倍率
 PLATFORM_STRETCH_X = 2.0      # 足場だけ横長にする倍率
 
+# 障害物との当たり判定
+#   "rect" : 画像の矩形どうし（従来どおり）
+#   "mask" : 矩形で当たったものだけピクセル単位で判定（透明な角では当たらない）
+#   "swept": 1ティックの間の動き（車は縦・障害物は横）を連続で判定する。
+#            高速で1フレームにすり抜ける場合も、いつ・どの面に当たったかがわかる
+#            （ティックの終わりでまだ重なっている場合はマスクでも確かめる）
+# 起動時は --collision で選べる（--bench-collision で速さを比べられる）
+COLLISION_MODES = ("rect", "mask", "swept")
+COLLISION_MODE = "swept"
+
+# ラン記録（リーダーボード）
+RUNLOG_PATH = "runs.bin"          # 固定長レコードの追記ログ
+RUNLOG_INDEX_PATH = "runs.idx"    # 上位N件＆スコア分布のインデックス
+LEADERBOARD_TOP_N = 10            # リーダーボードに表示する件数
+
+# テレメトリ（プレイ解析用のイベント記録）
+TELEMETRY_PATH = "telemetry.bin"  # 拡張子を .jsonl にすると1行1JSONで書く
+TELEMETRY_RING_SIZE = 8192        # リングバッファの件数（2のべき乗）
+TELEMETRY_BATCH = 512             # この件数たまったら書き込みスレッドを起こす
+TELEMETRY_FLUSH_SEC = 0.5         # たまらなくてもこの間隔で書き出す
+
+# ゴースト（過去のランの軌跡を半透明で一緒に走らせる）
+GHOST_DIR = "ghosts"              # 軌跡ファイルの保存先
+GHOST_MAX = 100                   # 同時に走らせる最大数（新しい順、保存するのもこの数まで）
+GHOST_ALPHA = 70                  # ゴーストの不透明度(0-255)
+
+# 入力
+JUMP_BUFFER_MS = 120              # 空中で押したジャンプを着地まで覚えておく時間（ミリ秒）
+INPUT_LATENCY_SAMPLES = 600       # 入力遅延の統計に使う直近のサンプル数
+
+# 一時停止・終了画面（止まっている間は描き直さずに入力を待って眠る）
+IDLE_WAIT_MS = 1000               # 入力がなくても起きて確認する間隔（ミリ秒）
+
+# メモリ診断（--memdiag）
+MEMDIAG_INTERVAL_MS = 5000        # レポート間隔（ミリ秒）
+MEMDIAG_WINDOW = 6                # この回数続けて増えていたら警告する
+MEMDIAG_TOP_LINES = 5             # Python側で増えた行を何件出すか
+
+# 仲間カー（隊列）
+FRIEND_SCORES = [2000, 5000]      # 仲間が1台ずつ増えるスコア
+CONVOY_MODE = False               # True なら FRIEND_SCORES の後も増え続ける（コンボイモード、--convoy）
+CONVOY_STEP = 1000                # コンボイモードで仲間が増えるスコア間隔
+CONVOY_MAX = 24                   # 仲間の最大数（4台×6段で画面に収まる数）
+FRIEND_GAP = 100                  # 仲間どうしの間隔（多いときは画面に収まるよう詰める）
+FRIEND_MIN_GAP = 50               # 詰めるときの最小間隔（これ以上は重ねず上の段に並べる）
+FRIEND_ROW_DY = 45                # 段が1つ上がるごとに持ち上げる高さ
+FRIEND_DELAY_FRAMES = 6           # 1台後ろになるごとに何フレーム前の自車の高さを追うか
+FRIEND_EASE = 0.12                # 目標位置への近づき具合
+
+# 操作キー（ジャンプのキー, 破壊のキー）
+CONTROLS_SOLO = ((pg.K_SPACE, pg.K_UP), (pg.K_LSHIFT,))
+CONTROLS_VERSUS = [((pg.K_UP,), (pg.K_RSHIFT,)),   # P1（上の画面）
+                   ((pg.K_w,), (pg.K_LSHIFT,))]    # P2（下の画面）
+
+# 2人対戦（--versus）
+VERSUS_VIEW_H = HEIGHT // 2        # 1人ぶんの表示の高さ（画面を上下に分ける）
+VERSUS_CAMERA_MARGIN = 60          # 車の上にあける余白（ジャンプで見切れないようにカメラが追う）
+VERSUS_CAMERA_EASE = 0.25          # カメラが目標の高さに近づく速さ
+
+# スナップショットと巻き戻し
+REWIND_SEC = 3                    # R キーで戻る秒数（この分のスナップショットを持つ）
+
+# 外部連携（共有メモリの観測リング）
+OBS_SHM_NAME = "superrun_obs"     # 共有メモリの名前（--publish で変更可）
+OBS_RING_SLOTS = 64               # リングのフレーム数（約1秒）
+OBS_MAX_OBSTACLES = 16            # 1フレームに載せる障害物の最大数
+OBS_STALE_SEC = 0.5               # 書き手 pid のない古いリングを残骸とみなすまでの待ち時間
+
 
 # =========================
 # 共通描画関数
 # =========================
+def fig_path(name):
+    """fig フォルダの中のファイルのパス（どこから起動・import しても同じ場所を指す）"""
+    return os.path.join(BASE_DIR, "fig", name)
+
+
 def draw_text(surface, text, font, x, y, color=TEXT_COLOR):
     """左上基準でテキスト描画"""
     img = font.render(text, True, color)
@@ -97,38 +195,413 @@ def draw_bg_scroll(surface, img_a, img_b, scroll_x):
         x += pair_w
 
 
+FLOOR_TILE = 40  # 床ブロック1個のサイズ（正方形）
+
+# 床タイルを1行ぶん並べた画像のキャッシュ {(本体色, 枠色): Surface}
+_floor_strip_cache = {}
+
+
+def make_floor_strip(main_color, edge_color):
+    """
+    GROUND_Y から下を埋める床タイル一式を1枚の画像にする。
+    角丸の外側は透明のまま（背景が見える）。
+    """
+    tile = FLOOR_TILE
+    strip = pg.Surface((WIDTH + tile, HEIGHT - GROUND_Y), pg.SRCALPHA)
+    for y in range(0, HEIGHT - GROUND_Y, tile):
+        for x in range(0, WIDTH + tile, tile):
+            rect = pg.Rect(x, y, tile, tile)
+            pg.draw.rect(strip, main_color, rect, border_radius=4)
+            pg.draw.rect(strip, edge_color, rect, width=3, border_radius=4)
+
+            highlight_rect = pg.Rect(x + 4, y + 4, tile - 8, tile - 24)
+            pg.draw.rect(strip, (220, 180, 80), highlight_rect, border_radius=4)
+    return strip
+
+
 def draw_floor_tiles(surface, scroll_x):
     """
     マリオっぽい床タイルを描画する。
     - GROUND_Y から下をブロックで埋める
     - 横方向はスクロールして流れてるように見せる
+    タイルは色ごとに1度だけ描いておき、毎フレームは1回の blit で済ませる。
     """
     global current_block_main_color, current_block_edge_color
 
-    tile = 40  # ブロック1個のサイズ（正方形）
+    key = (current_block_main_color, current_block_edge_color)
+    strip = _floor_strip_cache.get(key)
+    if strip is None:
+        strip = _floor_strip_cache[key] = make_floor_strip(*key)
 
     # スクロール量をタイル単位でループさせる
-    start_x = int(scroll_x) % tile
-    start_x -= tile
+    start_x = int(scroll_x) % FLOOR_TILE
+    start_x -= FLOOR_TILE
 
-    # GROUND_Y から下を全部タイルで埋める（現在の色で描画）
-    for y in range(GROUND_Y, HEIGHT, tile):
-        for x in range(start_x, WIDTH + tile, tile):
-            rect = pg.Rect(x, y, tile, tile)
-            pg.draw.rect(surface, current_block_main_color, rect, border_radius=4)
-            pg.draw.rect(surface, current_block_edge_color, rect, width=3, border_radius=4)
+    surface.blit(strip, (start_x, GROUND_Y))
+
+
+# =========================
+# パイプライン描画
+# =========================
+# DrawList の命令の種類
+OP_BLIT = 0
+OP_BLITS = 1
+OP_ALPHA = 2
+OP_FILL = 3
+
+
+class DrawList:
+    """
+    1フレームぶんの描画命令の記録（パイプライン描画用）。
+    Surface と同じ blit / blits / fill で積むだけで、実際の描画は描画スレッドが行う。
+    座標はその場でタプルにコピーするので、記録した後にスプライトが動いても影響しない。
+    """
+    def __init__(self):
+        self.ops = []
+        self.input_stamps = ()  # このフレームで反映した入力の時刻（遅延計測用）
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        x, y = dest[0], dest[1]
+        self.ops.append((OP_BLIT, source, (x, y), area and pg.Rect(area), special_flags))
+        return pg.Rect(x, y, *source.get_size())
+
+    def blits(self, blit_sequence, doreturn=True):
+        seq = []
+        for item in blit_sequence:
+            source, dest = item[0], item[1]
+            seq.append((source, (dest[0], dest[1])) + tuple(item[2:]))
+        self.ops.append((OP_BLITS, seq, None, None, 0))
+        if doreturn:
+            return [pg.Rect(item[1], item[0].get_size()) for item in seq]
+        return None
+
+    def blit_alpha(self, source, dest, alpha):
+        """source の不透明度は描画スレッド側で変える（メインスレッドは触らない）"""
+        self.ops.append((OP_ALPHA, source, (dest[0], dest[1]), None, alpha))
+
+    def fill(self, color, rect=None):
+        self.ops.append((OP_FILL, color, None, rect and pg.Rect(rect), 0))
+
+    def replay(self, surface):
+        """記録した命令を surface に実行する（描画スレッド用）"""
+        for op, a, dest, area, arg in self.ops:
+            if op == OP_BLIT:
+                surface.blit(a, dest, area, arg)
+            elif op == OP_BLITS:
+                surface.blits(a, doreturn=False)
+            elif op == OP_ALPHA:
+                a.set_alpha(arg)
+                surface.blit(a, dest)
+            else:
+                surface.fill(a, area)
+
+
+def blit_alpha(surface, img, dest, alpha):
+    """img を不透明度 alpha で描く（DrawList なら描画スレッドで alpha をかける）"""
+    if isinstance(surface, DrawList):
+        surface.blit_alpha(img, dest, alpha)
+    else:
+        img.set_alpha(alpha)
+        surface.blit(img, dest)
+
+
+class Presenter:
+    """
+    描画スレッド。
+    メインスレッドが作った DrawList をオフスクリーンの2枚のバッファに交互に描き、
+    画面に転送して display.update する。その間にメインスレッドは次のフレームの
+    ロジックを進める（blit や flip の間は GIL が外れるのでマルチコアで重なる）。
+    """
+    def __init__(self, screen, on_present=None):
+        self.screen = screen
+        self.on_present = on_present  # 画面に出た直後に (入力時刻リスト, 時刻) で呼ぶ
+        self.buffers = [pg.Surface(screen.get_size()).convert() for _ in range(2)]
+        self.back = 0
+        self._queue = queue.Queue(maxsize=1)  # 先行できるのは1フレームまで
+        self._thread = threading.Thread(target=self._run, name="presenter", daemon=True)
+        self._thread.start()
+
+    def submit(self, draw_list):
+        """次のフレームを渡す（前のフレームがまだ待っていれば空くまで待つ）"""
+        self._queue.put(draw_list)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            draw_list = self._queue.get()
+            if draw_list is None:
+                return
+            buf = self.buffers[self.back]
+            try:
+                draw_list.replay(buf)
+                self.screen.blit(buf, (0, 0))
+                pg.display.update()
+                if self.on_present is not None and draw_list.input_stamps:
+                    self.on_present(draw_list.input_stamps, time.perf_counter())
+            except Exception as e:
+                telemetry.log("描画スレッドエラー:", e)
+            self.back ^= 1
+
+
+class TextureBackend:
+    """
+    SDL2 の Renderer / Texture で DrawList を描く（--backend texture）。
+    Presenter と同じく submit(draw_list) でフレームを受け取るが、描くのはメインスレッド
+    （Renderer はスレッドをまたいで使えない）。
+    ・Surface は最初に使われたときに1回だけ Texture にして、Surface が消えるまで使い回す
+      （背景・床・障害物・車などは以後アップロードしない。毎フレーム作る HUD の文字は毎回）
+    ・描いた後に中身を書き換える Surface は使わない前提
+    ・ハードウェアのレンダラがなければソフトウェアレンダラを使う（GPU なしの Linux でも動く）
+    """
+    def __init__(self, size, title, on_present=None):
+        if sdl2_video is None:
+            raise RuntimeError("pygame._sdl2 が使えません")
+        self.on_present = on_present
+        self.window = sdl2_video.Window(title, size)
+        self.renderer = None
+        for accelerated in (1, 0):
+            try:
+                self.renderer = sdl2_video.Renderer(self.window, accelerated=accelerated)
+                self.accelerated = bool(accelerated)
+                break
+            except Exception as e:  # pygame._sdl2 のエラーは pg.error ではない
+                error = e
+        if self.renderer is None:
+            raise error
+        self.textures = weakref.WeakKeyDictionary()  # Surface → Texture
+        self.uploads = 0   # 作った Texture の数（--frames の結果に出す）
+
+    def texture(self, surf):
+        tex = self.textures.get(surf)
+        if tex is None:
+            tex = self.textures[surf] = sdl2_video.Texture.from_surface(self.renderer, surf)
+            self.uploads += 1
+        return tex
+
+    def submit(self, draw_list):
+        renderer = self.renderer
+        texture = self.texture
+        renderer.draw_color = (0, 0, 0, 255)
+        renderer.clear()
+        for op, a, dest, area, arg in draw_list.ops:
+            if op == OP_BLIT:
+                texture(a).draw(srcrect=area, dstrect=dest)
+            elif op == OP_BLITS:
+                for item in a:
+                    texture(item[0]).draw(srcrect=item[2] if len(item) > 2 else None,
+                                          dstrect=item[1])
+            elif op == OP_ALPHA:
+                tex = texture(a)
+                tex.alpha = arg
+                tex.draw(dstrect=dest)
+            else:
+                renderer.draw_color = pg.Color(a)
+                if area is None:
+                    renderer.clear()
+                else:
+                    renderer.fill_rect(area)
+        renderer.present()
+        if self.on_present is not None and draw_list.input_stamps:
+            self.on_present(draw_list.input_stamps, time.perf_counter())
+
+    def stop(self):
+        self.textures.clear()
+
+
+def bake_frame(canvas):
+    """描き終わったフレームを1枚の Surface にする（止まっている間はこれを出し直すだけ）"""
+    if isinstance(canvas, DrawList):
+        frame = pg.Surface((WIDTH, HEIGHT)).convert()
+        canvas.replay(frame)
+        return frame
+    return canvas.copy()
+
+
+def present_frame(frame, screen, presenter=None):
+    """bake_frame で作ったフレームをそのまま画面に出す"""
+    if presenter is not None:
+        draw_list = DrawList()
+        draw_list.blit(frame, (0, 0))
+        presenter.submit(draw_list)
+    else:
+        screen.blit(frame, (0, 0))
+        pg.display.update()
+
+
+def quit_game(presenter=None):
+    """描画スレッドを止めてから pygame を終了する"""
+    if presenter is not None:
+        presenter.stop()
+    pg.quit()
+    sys.exit()
+
+
+# =========================
+# テレメトリ
+# =========================
+# イベント種別（a, b の意味は種別ごと。player はプレイヤー番号で、P付きの種別だけ意味を持つ）
+TEL_STOMP = 0      # 踏みつぶし    P a=障害物kind b=スコア
+TEL_SIDE_HIT = 1   # 横から衝突    P a=障害物kind b=残機
+TEL_STAR = 2       # スター取得    P
+TEL_MUSHROOM = 3   # きのこ取得    P b=残機
+TEL_DESTROY = 4    # Shift破壊     P a=障害物kind b=残りストック
+TEL_EVENT = 5      # ランダムイベント a=EVENT_LSTの番号
+TEL_DEATH = 6      # ゲームオーバー P b=スコア
+TEL_GOAL = 7       # ゴール        P b=スコア
+TEL_DROPPED = 8    # リングあふれで捨てた件数 a=件数
+TEL_RUN = 9        # ランの始まり（ファイルは追記なので区切りになる） a=シードの上位16bit b=下位16bit
+TEL_NAMES = ["stomp", "side_hit", "star", "mushroom", "destroy",
+             "event", "death", "goal", "dropped", "run"]
+
+
+class Telemetry:
+    """
+    プレイ中のできごとをファイルに記録する。
+    ・emit() はゲームスレッドから呼ぶ。事前確保したリングに書くだけでI/Oはしない
+    ・裏の書き込みスレッドがまとめて取り出してファイルに書く
+    ・リングが一杯のときは待たずに捨てて dropped を数える（フレームを止めない）
+    ・ファイルには追記し、ランごとに先頭へシード入りの TEL_RUN を置く
+    """
+    REC = struct.Struct("<IHBxii")  # t(ms), kind, player, a, b
+
+    def __init__(self, size=TELEMETRY_RING_SIZE, batch=TELEMETRY_BATCH):
+        assert size & (size - 1) == 0, "size は2のべき乗"
+        self.size = size
+        self.mask = size - 1
+        self.batch = batch
+
+        # リング本体（種別ごとの並列リスト、書き込み側は head、読み出し側は tail だけ進める）
+        self._kind = [0] * size
+        self._t = [0] * size
+        self._a = [0] * size
+        self._b = [0] * size
+        self._player = [0] * size
+        self.head = 0
+        self.tail = 0
+
+        self.dropped = 0   # リングあふれで捨てた件数
+        self.written = 0   # ファイルに書いた件数
+        self._dropped_reported = 0
+
+        self._logs = deque(maxlen=256)  # エラーメッセージ（printも裏スレッドで）
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._file = None
+        self._jsonl = False
+
+    def emit(self, kind, t, a=0, b=0, player=0):
+        """イベントを1件積む（ゲームスレッド用）"""
+        head = self.head
+        fill = head - self.tail
+        if fill >= self.size:
+            self.dropped += 1
+            return
+        i = head & self.mask
+        self._kind[i] = kind
+        self._t[i] = t
+        self._a[i] = a
+        self._b[i] = b
+        self._player[i] = player
+        self.head = head + 1
+        if fill + 1 == self.batch:  # たまりきった1回だけ起こす（以後は起きるまで積むだけ）
+            self._wake.set()
+
+    def log(self, *args):
+        """print の代わり。書き込みスレッドが動いていればそちらで出力する"""
+        if self._thread is None:
+            print(*args)
+            return
+        self._logs.append(args)
+        self._wake.set()
+
+    def start(self, path=TELEMETRY_PATH, seed=0):
+        """書き込みスレッドを始める（seed はこのランの乱数シード、TEL_RUN に書く）"""
+        self._jsonl = path.endswith(".jsonl")
+        self._stopping = False
+        self._file = open(path, "a" if self._jsonl else "ab", buffering=1 << 16)
+        self.emit(TEL_RUN, 0, seed >> 16, seed & 0xFFFF)
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """残りを書き出してスレッドを止める"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        while self._logs:
+            print(*self._logs.popleft())
+
+    def _run(self):
+        while True:
+            self._wake.wait(TELEMETRY_FLUSH_SEC)
+            self._wake.clear()
+            stopping = self._stopping
+            try:
+                self._drain()
+            except Exception as e:
+                print("テレメトリ書き込みエラー:", e)
+            if stopping:
+                return
+
+    def _drain(self):
+        while self._logs:
+            print(*self._logs.popleft())
+
+        head = self.head
+        tail = self.tail
+        rows = []
+        while tail < head:
+            i = tail & self.mask
+            rows.append((self._t[i], self._kind[i], self._player[i], self._a[i], self._b[i]))
+            tail += 1
+        self.tail = tail  # ここでリングの枠を返す（ファイル書き込みは枠の外で）
+
+        dropped = self.dropped
+        if dropped != self._dropped_reported:
+            t = rows[-1][0] if rows else 0
+            rows.append((t, TEL_DROPPED, 0, dropped - self._dropped_reported, 0))
+            self._dropped_reported = dropped
+        if not rows:
+            return
+
+        if self._jsonl:
+            self._file.write("".join(
+                f'{{"t":{t},"kind":"{TEL_NAMES[k]}","player":{p},"a":{a},"b":{b}}}\n'
+                for t, k, p, a, b in rows))
+        else:
+            pack = self.REC.pack
+            self._file.write(b"".join(pack(t, k, p, a, b) for t, k, p, a, b in rows))
+        self._file.flush()
+        self.written += len(rows)
 
-            highlight_rect = pg.Rect(x + 4, y + 4, tile - 8, tile - 24)
-            pg.draw.rect(surface, (220, 180, 80), highlight_rect, border_radius=4)
+
+telemetry = Telemetry()
 
 
 # =========================
 # パーティクル
 # =========================
+_particle_img_cache = {}  # 復元したパーティクルの画像（大きさと色ごと）
+
+
 class Particle(pg.sprite.Sprite):
     """障害物破壊時のパーティクルエフェクト"""
+    SNAP = struct.Struct("<iiBBBBddii")  # x, y, size, 色(r, g, b), vx, vy, life, alpha
+
     def __init__(self, x, y, color, size):
         super().__init__()
+        self.color = color
+        self.size = size
         self.image = pg.Surface((size, size), pg.SRCALPHA)
         pg.draw.rect(self.image, color, (0, 0, size, size))
         self.rect = self.image.get_rect(center=(x, y))
@@ -136,6 +609,7 @@ class Particle(pg.sprite.Sprite):
         self.vy = random.uniform(-10, -2)
         self.g = 0.5
         self.life = 30  # 寿命（フレーム）
+        self.alpha = 255
 
     def update(self):
         self.vy += self.g
@@ -147,8 +621,34 @@ class Particle(pg.sprite.Sprite):
             self.kill()
             return
 
-        alpha = int(255 * (self.life / 30))
-        self.image.set_alpha(alpha)
+        # 画像はここでは触らず、描くときに alpha をかける
+        self.alpha = int(255 * (self.life / 30))
+
+    def draw(self, surface):
+        blit_alpha(surface, self.image, self.rect, self.alpha)
+
+    def snap(self):
+        return (self.rect.x, self.rect.y, self.size, *self.color,
+                self.vx, self.vy, self.life, self.alpha)
+
+    @classmethod
+    def unsnap(cls, vals):
+        x, y, size, r, g, b, vx, vy, life, alpha = vals
+        self = bare_sprite(cls)
+        self.color = (r, g, b)
+        self.size = size
+        key = (size, r, g, b)
+        self.image = _particle_img_cache.get(key)
+        if self.image is None:
+            # 描くたびに alpha をかけ直すので、同じ色と大きさなら画像を共有できる
+            if len(_particle_img_cache) >= 1024:
+                _particle_img_cache.clear()
+            self.image = _particle_img_cache[key] = pg.Surface((size, size), pg.SRCALPHA)
+            self.image.fill(self.color)
+        self.rect = pg.Rect(x, y, size, size)
+        self.vx, self.vy, self.g = vx, vy, 0.5
+        self.life, self.alpha = life, alpha
+        return self
 
 
 # =========================
@@ -162,13 +662,16 @@ class Car(pg.sprite.Sprite):
     ・ジャンプ時に効果音
     ・Shiftで前方の障害物を破壊（スコア条件つき）
     ・スター取得中は無敵で点滅
+    controls は (ジャンプのキー, 破壊のキー)（2人対戦ではプレイヤーごとに変える）
     """
-    def __init__(self, car_img, jump_sound=None):
+    def __init__(self, car_img, jump_sound=None, controls=CONTROLS_SOLO):
         super().__init__()
+        self.jump_keys, self.destroy_keys = controls
         self.image = car_img
         self.rect = self.image.get_rect()
         self.rect.left = 200
         self.rect.bottom = GROUND_Y
+        self.mask = pg.mask.from_surface(self.image)  # ピクセル判定用（1回だけ作る）
 
         # 物理
         self.vel_y = 0.0
@@ -185,34 +688,40 @@ class Car(pg.sprite.Sprite):
         # Shift破壊クールダウン
         self.destroy_cooldown = 0
 
+        self.jumped = False  # このフレームでジャンプしたか
+        self.prev_y = self.rect.y
+
         self.jump_sound = jump_sound
 
     def on_ground(self):
         return self.rect.bottom >= self.floor_y - 1
 
-    def handle_input(self, key_lst):
-        jump_pressed = key_lst[pg.K_SPACE] or key_lst[pg.K_UP]
+    def handle_input(self, key_lst, jump_request=False):
+        jump_pressed = any(key_lst[k] for k in self.jump_keys)
 
-        # 新しく押した瞬間 & 足場の上 → ジャンプ
-        if jump_pressed and (not self.jump_held) and self.on_ground():
+        # 新しく押した瞬間（またはイベントで届いた押下） & 足場の上 → ジャンプ
+        self.jumped = False
+        if (jump_request or (jump_pressed and not self.jump_held)) and self.on_ground():
             self.vel_y = JUMP_VELOCITY
+            self.jumped = True
             if self.jump_sound is not None:
                 try:
                     self.jump_sound.play()
                 except Exception as e:
-                    print("ジャンプ音エラー:", e)
+                    telemetry.log("ジャンプ音エラー:", e)
 
         self.jump_held = jump_pressed
 
         # Shift → 障害物破壊要求フラグ
         destroy_flag = False
-        if key_lst[pg.K_LSHIFT] and self.destroy_cooldown <= 0:
+        if any(key_lst[k] for k in self.destroy_keys) and self.destroy_cooldown <= 0:
             destroy_flag = True
             self.destroy_cooldown = 10  # 10フレームクールダウン
 
         return destroy_flag
 
     def apply_physics(self):
+        self.prev_y = self.rect.y  # 連続判定用（このティックの開始位置）
         self.vel_y += GRAVITY
         self.rect.y += self.vel_y
 
@@ -244,8 +753,8 @@ class Car(pg.sprite.Sprite):
         # 無敵中は点滅
         return (self.blink_counter // STAR_BLINK_INTERVAL) % 2 == 0
 
-    def update(self, key_lst):
-        destroy_flag = self.handle_input(key_lst)
+    def update(self, key_lst, jump_request=False):
+        destroy_flag = self.handle_input(key_lst, jump_request)
         self.apply_physics()
         self.update_cooldown()
         return destroy_flag
@@ -254,24 +763,209 @@ class Car(pg.sprite.Sprite):
         if self.should_draw():
             surface.blit(self.image, self.rect)
 
+    # x, y, vel_y, jump_held, 無敵, 無敵開始時刻, 点滅カウンタ, 足場, クールダウン, jumped, prev_y
+    SNAP = struct.Struct("<iidBBqiiiBi")
+
+    def snap(self):
+        return (self.rect.x, self.rect.y, self.vel_y, self.jump_held,
+                self.is_invincible, self.invincible_start_time, self.blink_counter,
+                self.floor_y, self.destroy_cooldown, self.jumped, self.prev_y)
+
+    def load(self, vals):
+        (self.rect.x, self.rect.y, self.vel_y, jump_held, is_invincible,
+         self.invincible_start_time, self.blink_counter, self.floor_y,
+         self.destroy_cooldown, jumped, self.prev_y) = vals
+        self.jump_held = bool(jump_held)
+        self.is_invincible = bool(is_invincible)
+        self.jumped = bool(jumped)
+
+# =========================
+# ゴースト
+# =========================
+GHOST_MAGIC = b"SRGHOST1"
+GHOST_HEADER = struct.Struct("<8sQ")  # magic, seed
+GHOST_ABS = struct.Struct("<hh")      # 差分で表せないときの絶対座標
+GHOST_ESCAPE = 0x80                   # この1バイトの後ろに絶対座標
+
+
+class GhostRecorder:
+    """
+    自車の軌跡を記録する。
+    1フレームにつき前フレームとの差分 (dx, dy) を符号付き1バイトずつで持つ。
+    差分が収まらないとき（最初のフレームなど）は ESCAPE + 絶対座標。
+    """
+    def __init__(self, seed):
+        self.buf = bytearray(GHOST_HEADER.pack(GHOST_MAGIC, seed))
+        self.last_x = None
+        self.last_y = None
+
+    def record(self, rect):
+        x, y = rect.x, rect.y
+        if self.last_x is not None:
+            dx = x - self.last_x
+            dy = y - self.last_y
+            if -127 <= dx <= 127 and -127 <= dy <= 127:
+                self.buf.append(dx & 0xFF)
+                self.buf.append(dy & 0xFF)
+                self.last_x = x
+                self.last_y = y
+                return
+        self.buf.append(GHOST_ESCAPE)
+        self.buf += GHOST_ABS.pack(x, y)
+        self.last_x = x
+        self.last_y = y
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(self.buf)
+
+
+class GhostTrack:
+    """軌跡ファイルを少しずつ読みながら1フレームずつ座標を返す"""
+    CHUNK = 4096
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        magic, self.seed = GHOST_HEADER.unpack(self.file.read(GHOST_HEADER.size))
+        if magic != GHOST_MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} はゴーストファイルではありません")
+        self.buf = b""
+        self.i = 0
+        self.eof = False
+        self.x = 0
+        self.y = 0
+
+    def next(self):
+        """次のフレームの (x, y)。最後まで再生したら None"""
+        buf = self.buf
+        i = self.i
+        if len(buf) - i < 1 + GHOST_ABS.size and not self.eof:
+            chunk = self.file.read(self.CHUNK)
+            if not chunk:
+                self.eof = True
+            buf = self.buf = buf[i:] + chunk
+            i = 0
+        if i >= len(buf):
+            return None
+
+        b = buf[i]
+        if b == GHOST_ESCAPE:
+            if len(buf) - i < 1 + GHOST_ABS.size:
+                return None  # 途中で切れたファイル
+            self.x, self.y = GHOST_ABS.unpack_from(buf, i + 1)
+            i += 1 + GHOST_ABS.size
+        else:
+            if i + 1 >= len(buf):
+                return None
+            dy = buf[i + 1]
+            self.x += b - 256 if b > 127 else b
+            self.y += dy - 256 if dy > 127 else dy
+            i += 2
+        self.i = i
+        return self.x, self.y
+
+    def close(self):
+        self.file.close()
+
+
+class GhostRace:
+    """
+    過去のランのゴーストをまとめて走らせる。
+    ゴーストは Car ではなく座標だけを持ち、共通の半透明画像1枚を blits でまとめて描く。
+    """
+    def __init__(self, car_img, ghost_dir=GHOST_DIR, max_ghosts=GHOST_MAX):
+        # 透明度をピクセルのアルファに焼き込んだゴースト画像（全員で共有）
+        self.image = car_img.copy()
+        self.image.fill((255, 255, 255, GHOST_ALPHA), special_flags=pg.BLEND_RGBA_MULT)
+        self.visible = True
+        self.tracks = []
+        self.blit_seq = []
+
+        if not os.path.isdir(ghost_dir):
+            return
+        names = sorted(n for n in os.listdir(ghost_dir) if n.endswith(".ghost"))
+        for name in names[-max_ghosts:] if max_ghosts > 0 else []:
+            try:
+                self.tracks.append(GhostTrack(os.path.join(ghost_dir, name)))
+            except Exception as e:
+                telemetry.log("ゴースト読み込みエラー:", name, e)
+
+    def update(self):
+        """全ゴーストを1フレーム進める（再生し終わったものは消える）"""
+        img = self.image
+        alive = []
+        seq = []
+        for track in self.tracks:
+            pos = track.next()
+            if pos is None:
+                track.close()
+                continue
+            alive.append(track)
+            seq.append((img, pos))
+        self.tracks = alive
+        self.blit_seq = seq
+
+    def draw(self, surface):
+        if self.visible and self.blit_seq:
+            surface.blits(self.blit_seq, doreturn=False)
+
+
+def ghost_path(seed, timestamp, ghost_dir=GHOST_DIR):
+    """ファイル名順＝記録順になるように時刻を先頭に付ける"""
+    return os.path.join(ghost_dir, f"{timestamp:012d}_{seed:010d}.ghost")
+
+
+def prune_ghosts(ghost_dir=GHOST_DIR, keep=GHOST_MAX):
+    """
+    新しい keep 件だけ残して古いゴーストファイルを消す（保存のたびに呼ぶ）。
+    走らせるのは新しい GHOST_MAX 件だけなので、それより古いものは使われない。
+    """
+    names = sorted(n for n in os.listdir(ghost_dir) if n.endswith(".ghost"))
+    for name in names[:max(0, len(names) - keep)]:
+        try:
+            os.remove(os.path.join(ghost_dir, name))
+        except FileNotFoundError:
+            pass
+
+
 # =========================
 # ゴール旗クラス（画像）
 # =========================
 class Goal(pg.sprite.Sprite):
     """旗画像のゴール。プレイヤーが触れるとクリア。"""
+    SNAP = struct.Struct("<ii")  # x, y
+    _image = None  # 旗画像（最初の1回だけ読み込む）
+
     def __init__(self, x, y):
         super().__init__()
-        # 旗画像を読み込み
-        img = pg.image.load("fig/goal.jpg").convert_alpha()
-
-        # 好きな大きさに調整（高さ120pxに合わせる例）
-        FLAG_H = 120
-        aspect = img.get_width() / img.get_height()
-        FLAG_W = int(FLAG_H * aspect)
-        self.image = pg.transform.smoothscale(img, (FLAG_W, FLAG_H))
-
+        self.image = self.flag_image()
         self.rect = self.image.get_rect(midbottom=(x, y))
 
+    @classmethod
+    def flag_image(cls):
+        if cls._image is None:
+            # 旗画像を読み込み
+            img = pg.image.load(fig_path("goal.jpg")).convert_alpha()
+
+            # 好きな大きさに調整（高さ120pxに合わせる例）
+            FLAG_H = 120
+            aspect = img.get_width() / img.get_height()
+            FLAG_W = int(FLAG_H * aspect)
+            cls._image = pg.transform.smoothscale(img, (FLAG_W, FLAG_H))
+        return cls._image
+
+    def snap(self):
+        return (self.rect.x, self.rect.y)
+
+    @classmethod
+    def unsnap(cls, vals):
+        self = bare_sprite(cls)
+        self.image = cls.flag_image()
+        self.rect = self.image.get_rect(topleft=vals)
+        return self
+
     def update(self, world_speed):
         # 画面に合わせて左に流れる
         self.rect.x -= world_speed
@@ -282,6 +976,114 @@ class Goal(pg.sprite.Sprite):
 # =========================
 # 障害物
 # =========================
+# 縮小済みの障害物画像とマスクのキャッシュ {(元画像id, w, h): (画像, マスク)}
+# 高さは 60〜160 の整数なので種類×高さぶんしかたまらない
+_obstacle_img_cache = {}
+
+
+def scaled_obstacle_image(src_img, w, h):
+    """障害物画像を (w, h) に縮小したものとそのマスクを返す（同じサイズは使い回し）"""
+    key = (id(src_img), w, h)
+    cached = _obstacle_img_cache.get(key)
+    if cached is None:
+        img = pg.transform.smoothscale(src_img, (w, h))
+        cached = _obstacle_img_cache[key] = (img, pg.mask.from_surface(img))
+    return cached
+
+
+def car_hits(car, obs):
+    """
+    車と障害物の当たり判定。
+    矩形で大まかに判定し、"mask" モードなら当たったものだけマスクで確かめる。
+    """
+    if not car.rect.colliderect(obs.rect):
+        return False
+    if COLLISION_MODE != "mask":
+        return True
+    offset = (obs.rect.x - car.rect.x, obs.rect.y - car.rect.y)
+    return car.mask.overlap(obs.mask, offset) is not None
+
+
+def swept_aabb(ax, ay, aw, ah, vx, vy, bx, by, bw, bh):
+    """
+    箱A（1ティックで vx, vy 動く）と止まっている箱Bが最初に触れる時刻を求める。
+    (t, nx, ny) を返す。t は 0〜1 でティック内の割合（0 は開始時点ですでに重なっている）、
+    (nx, ny) はBの当たった面の外向き法線（上面なら (0, -1)）。当たらなければ None。
+    """
+    inf = float("inf")
+    if vx > 0:
+        tx_entry = (bx - (ax + aw)) / vx
+        tx_exit = (bx + bw - ax) / vx
+    elif vx < 0:
+        tx_entry = (bx + bw - ax) / vx
+        tx_exit = (bx - (ax + aw)) / vx
+    elif ax + aw > bx and ax < bx + bw:
+        tx_entry, tx_exit = -inf, inf
+    else:
+        return None
+
+    if vy > 0:
+        ty_entry = (by - (ay + ah)) / vy
+        ty_exit = (by + bh - ay) / vy
+    elif vy < 0:
+        ty_entry = (by + bh - ay) / vy
+        ty_exit = (by - (ay + ah)) / vy
+    elif ay + ah > by and ay < by + bh:
+        ty_entry, ty_exit = -inf, inf
+    else:
+        return None
+
+    entry = max(tx_entry, ty_entry)
+    exit_ = min(tx_exit, ty_exit)
+    if entry >= exit_ or entry > 1 or exit_ <= 0:
+        return None
+
+    if entry < 0:
+        # 開始時点で重なっている → めり込みが一番浅い面を当たった面とする
+        pens = [
+            ((ax + aw) - bx, -1, 0),   # Bの左面
+            ((bx + bw) - ax, 1, 0),    # Bの右面
+            ((ay + ah) - by, 0, -1),   # Bの上面
+            ((by + bh) - ay, 0, 1),    # Bの下面
+        ]
+        _, nx, ny = min(pens)
+        return 0.0, nx, ny
+    if tx_entry > ty_entry:
+        return entry, (-1 if vx > 0 else 1), 0
+    return entry, 0, (-1 if vy > 0 else 1)
+
+
+def car_contact(car, obs):
+    """
+    車と障害物の接触を (t, nx, ny) で返す（当たっていなければ None）。
+    ny < 0 なら上から乗った（踏んだ）扱い。
+    "swept" 以外は従来どおりティックの終わりの位置だけで判定する。
+    """
+    if COLLISION_MODE != "swept":
+        if not car_hits(car, obs):
+            return None
+        landed_from_above = (
+            car.vel_y >= 0 and
+            car.rect.bottom <= obs.rect.top + 20
+        )
+        return (0.0, 0, -1) if landed_from_above else (0.0, -1, 0)
+
+    # 障害物から見た車の動き：車は縦に (rect.y - prev_y)、障害物は横に (rect.x - prev_x)
+    cr = car.rect
+    orc = obs.rect
+    contact = swept_aabb(cr.x, car.prev_y, cr.width, cr.height,
+                         obs.prev_x - orc.x, cr.y - car.prev_y,
+                         obs.prev_x, orc.y, orc.width, orc.height)
+    if contact is None:
+        return None
+    # ティックの終わりでまだ重なっているなら、透明な角だけの接触はマスクで除く
+    if cr.colliderect(orc):
+        offset = (orc.x - cr.x, orc.y - cr.y)
+        if car.mask.overlap(obs.mask, offset) is None:
+            return None
+    return contact
+
+
 class Obstacle(pg.sprite.Sprite):
     """
     障害物 
@@ -289,6 +1091,9 @@ class Obstacle(pg.sprite.Sprite):
         kind 1 → 踏めば倒せる(スコア +100)
         kind 2 → 足場になる（乗れる / 横に長い足場）
     """
+    # kind, x, y, w, h, speed, 破壊済み, 破壊タイマー, prev_x, 片付けたプレイヤー
+    SNAP = struct.Struct("<BiiHHdBiiB")
+
     def __init__(self, base_imgs, world_speed, spawn_x=None):
         super().__init__()
 
@@ -305,8 +1110,9 @@ class Obstacle(pg.sprite.Sprite):
 
         w = max(40, min(w, 300))
 
-        self.original_image = pg.transform.smoothscale(src_img, (w, h))
-        self.image = self.original_image.copy()
+        # 縮小画像とマスクはキャッシュを共有（画像は書き換えないのでコピーしない）
+        self.original_image, self.mask = scaled_obstacle_image(src_img, w, h)
+        self.image = self.original_image
         self.rect = self.image.get_rect()
 
         if spawn_x is None:
@@ -319,8 +1125,11 @@ class Obstacle(pg.sprite.Sprite):
         self.speed = world_speed
         self.is_destroyed = False
         self.destroy_timer = 0
+        self.prev_x = self.rect.x
+        self.cleared = 0  # 踏んだ・ぶつかった・壊したプレイヤーのビット（2人対戦用）
 
     def update(self, world_speed):
+        self.prev_x = self.rect.x  # 連続判定用（このティックの開始位置）
         if not self.is_destroyed:
             self.rect.x -= world_speed
             if self.rect.right < 0:
@@ -355,6 +1164,30 @@ class Obstacle(pg.sprite.Sprite):
     def is_platform(self):
         return self.kind == 2
 
+    def is_gone_for(self, player):
+        """プレイヤー番号 player からはもう当たらないか（破壊済みか、その人が片付け済み）"""
+        return self.is_destroyed or bool(self.cleared >> player & 1)
+
+    def snap(self):
+        r = self.rect
+        return (self.kind, r.x, r.y, r.w, r.h, self.speed,
+                self.is_destroyed, self.destroy_timer, self.prev_x, self.cleared)
+
+    @classmethod
+    def unsnap(cls, vals, base_imgs):
+        kind, x, y, w, h, speed, is_destroyed, destroy_timer, prev_x, cleared = vals
+        self = bare_sprite(cls)
+        self.kind = kind
+        self.original_image, self.mask = scaled_obstacle_image(base_imgs[kind], w, h)
+        self.image = self.original_image
+        self.rect = pg.Rect(x, y, w, h)
+        self.speed = speed
+        self.is_destroyed = bool(is_destroyed)
+        self.destroy_timer = destroy_timer
+        self.prev_x = prev_x
+        self.cleared = cleared
+        return self
+
     def destroy(self, particles_group):
         """障害物を破壊し、パーティクルを生成"""
         if self.is_destroyed:
@@ -379,30 +1212,41 @@ class Obstacle(pg.sprite.Sprite):
 # =========================
 class StarItem(pg.sprite.Sprite):
     """スターアイテム（取ると無敵）"""
+    SNAP = struct.Struct("<iid")  # x, y, speed
+    SIZE = 30
+    _image = None  # 星形の画像（全スターで共有、書き換えない）
+
     def __init__(self, obstacles_group):
         super().__init__()
-        self.size = 30
-        self.image = pg.Surface((self.size, self.size), pg.SRCALPHA)
-
-        # 星形
-        points = []
-        for i in range(5):
-            angle = math.pi / 2 + i * 2 * math.pi / 5
-            points.append((
-                self.size / 2 + self.size / 2 * math.cos(angle),
-                self.size / 2 + self.size / 2 * math.sin(angle)
-            ))
-            angle += math.pi / 5
-            points.append((
-                self.size / 2 + self.size / 4 * math.cos(angle),
-                self.size / 2 + self.size / 4 * math.sin(angle)
-            ))
-        pg.draw.polygon(self.image, (255, 255, 0), points)
+        self.size = self.SIZE
+        self.image = self.star_image()
 
         self.rect = self.image.get_rect()
         self._find_valid_position(obstacles_group)
         self.speed = 8.0
 
+    @classmethod
+    def star_image(cls):
+        if cls._image is None:
+            size = cls.SIZE
+            cls._image = pg.Surface((size, size), pg.SRCALPHA)
+
+            # 星形
+            points = []
+            for i in range(5):
+                angle = math.pi / 2 + i * 2 * math.pi / 5
+                points.append((
+                    size / 2 + size / 2 * math.cos(angle),
+                    size / 2 + size / 2 * math.sin(angle)
+                ))
+                angle += math.pi / 5
+                points.append((
+                    size / 2 + size / 4 * math.cos(angle),
+                    size / 2 + size / 4 * math.sin(angle)
+                ))
+            pg.draw.polygon(cls._image, (255, 255, 0), points)
+        return cls._image
+
     def _find_valid_position(self, obstacles_group):
         max_attempts = 20
         for _ in range(max_attempts):
@@ -429,6 +1273,19 @@ class StarItem(pg.sprite.Sprite):
     def draw(self, surface):
         surface.blit(self.image, self.rect)
 
+    def snap(self):
+        return (self.rect.x, self.rect.y, self.speed)
+
+    @classmethod
+    def unsnap(cls, vals):
+        x, y, speed = vals
+        self = bare_sprite(cls)
+        self.size = cls.SIZE
+        self.image = cls.star_image()
+        self.rect = self.image.get_rect(topleft=(x, y))
+        self.speed = speed
+        return self
+
 
 # =========================
 # スコア＆仲間カー
@@ -444,7 +1301,7 @@ class Score:
 
         self.car = car
         self.car_img = car_img
-        self.friends = []
+        self.friends = Convoy(car, car_img)
 
         # Shift破壊関連
         self.destroy_count = 0
@@ -479,28 +1336,28 @@ class Score:
             return True
         return False
 
-    def update_friends(self, key_lst):
-        for friend in self.friends:
-            friend.update(key_lst)
+    def update_friends(self):
+        self.friends.update()
 
     def draw_friends(self, screen):
-        for friend in self.friends:
-            friend.draw(screen)
+        self.friends.draw(screen)
 
     def check_for_friends(self):
         """スコアに応じて仲間カーを追加"""
-        if self.value >= 2000 and len(self.friends) == 0:
-            new_friend = FriendCar(self.car_img,
-                                   self.car.rect.left - 100,
-                                   GROUND_Y,
-                                   self.car)
-            self.friends.append(new_friend)
-        if self.value >= 5000 and len(self.friends) == 1:
-            new_friend2 = FriendCar(self.car_img,
-                                    self.car.rect.left - 200,
-                                    GROUND_Y,
-                                    self.car)
-            self.friends.append(new_friend2)
+        n = sum(1 for v in FRIEND_SCORES if self.value >= v)
+        if CONVOY_MODE and n == len(FRIEND_SCORES):
+            n += (self.value - FRIEND_SCORES[-1]) // CONVOY_STEP
+        n = min(n, CONVOY_MAX)
+        while len(self.friends) < n:
+            self.friends.add()
+
+    SNAP = struct.Struct("<qdii")  # value, multiplier, 破壊ストック, 次のストックの基準
+
+    def snap(self):
+        return (self.value, self.multiplier, self.destroy_count, self.last_destroy_threshold)
+
+    def load(self, vals):
+        self.value, self.multiplier, self.destroy_count, self.last_destroy_threshold = vals
 
     def draw(self, screen):
         img = self.font.render(f"SCORE: {self.value}", True, self.color)
@@ -511,35 +1368,101 @@ class Score:
         screen.blit(dimg, (20, 60))
 
 
-class FriendCar(Car):
-    """仲間カー（プレイヤーの後ろを追従）"""
-    def __init__(self, car_img, spawn_x, spawn_y, target_car):
-        super().__init__(car_img, jump_sound=None)
-        self.rect.left = spawn_x
-        self.rect.bottom = spawn_y
-        self.target_car = target_car
-
-        self.follow_distance = 100
-        self.ease = 0.12
+class Convoy:
+    """
+    仲間カーの隊列（プレイヤーの後ろを追従）
+    仲間は Car を持たず座標だけを持つ。自車の高さの履歴リングを共有し、
+    k台目は k * FRIEND_DELAY_FRAMES フレーム前の自車の高さを追う。
+    自車の後ろに FRIEND_MIN_GAP 以上あけて並べ、横に入りきらない分は上の段に積む。
+    全員を1回のリスト内包で動かし、共通の画像を blits でまとめて描く。
+    """
+    def __init__(self, car, car_img, max_size=CONVOY_MAX):
+        self.car = car
+        self.image = car_img
+        self.hist_len = FRIEND_DELAY_FRAMES * max_size + 1
+        self.hist_y = [car.rect.bottom] * self.hist_len  # 自車の bottom の履歴
+        self.head = 0
+        self.xs = []  # 各仲間の left（小数で持つ）
+        self.blit_seq = []
 
-    def update(self, key_lst):
-        # 親の update でジャンプ/重力処理
-        super().update(key_lst)
+    def __len__(self):
+        return len(self.xs)
 
-        # X方向：プレイヤーの少し後ろに追従
-        target_x = self.target_car.rect.left - self.follow_distance
-        dx = target_x - self.rect.left
-        if abs(dx) > 1:
-            self.rect.left += int(dx * self.ease)
+    def add(self):
+        """最後尾に1台追加（画面左の外寄りから追いついてくる）"""
+        self.xs.append(float(self.car.rect.left - FRIEND_GAP * (len(self.xs) + 1)))
 
-        # Y方向：プレイヤーに近づける
-        dy = self.target_car.rect.bottom - self.rect.bottom
-        if abs(dy) > 1:
-            self.rect.bottom += int(dy * self.ease)
+    def update(self):
+        car = self.car
+        L = self.hist_len
+        h = (self.head + 1) % L
+        self.hist_y[h] = car.rect.bottom
+        self.head = h
+
+        n = len(self.xs)
+        if n == 0:
+            return
+        left = car.rect.left
+        cols = self.columns()
+        gap = max(FRIEND_MIN_GAP, min(FRIEND_GAP, left / min(n, cols)))
+        ease = FRIEND_EASE
+
+        # X：それぞれの持ち場に寄っていく / Y：少し前の自車の高さをなぞる
+        self.xs = [x + (left - gap * (k % cols + 1) - x) * ease
+                   for k, x in enumerate(self.xs)]
+        self._layout()
+
+    def columns(self):
+        """1段に並べる台数（自車の左に最小間隔で入る数）"""
+        return max(1, int(self.car.rect.left // FRIEND_MIN_GAP))
+
+    def _layout(self):
+        img = self.image
+        top = img.get_height()
+        hist = self.hist_y
+        h = self.head
+        L = self.hist_len
+        d = FRIEND_DELAY_FRAMES
+        cols = self.columns()
+        self.blit_seq = [(img, (int(x), hist[(h - d * (k + 1)) % L] - top
+                                - FRIEND_ROW_DY * (k // cols)))
+                         for k, x in enumerate(self.xs)]
+
+    COUNTS = struct.Struct("<HHH")  # 仲間の数, 履歴の先頭, 保存した履歴の長さ
+
+    def pack(self):
+        """
+        隊列の状態をバイト列にする（数 + 各仲間の x + 高さの履歴）。
+        履歴は今いる仲間と次に増える1台が見る分（新しい順）だけ入れる。
+        """
+        n = len(self.xs)
+        L = self.hist_len
+        h = self.head
+        depth = min(L, FRIEND_DELAY_FRAMES * (n + 1) + 1)
+        hist = self.hist_y
+        recent = [hist[(h - j) % L] for j in range(depth)]
+        return (self.COUNTS.pack(n, h, depth) + struct.pack(f"<{n}d", *self.xs)
+                + struct.pack(f"<{depth}h", *recent))
+
+    def unpack_from(self, buf, off):
+        """pack() の中身を読み込み、読み終えた位置を返す"""
+        n, h, depth = self.COUNTS.unpack_from(buf, off)
+        off += self.COUNTS.size
+        self.xs = list(struct.unpack_from(f"<{n}d", buf, off))
+        off += 8 * n
+        recent = struct.unpack_from(f"<{depth}h", buf, off)
+        L = self.hist_len
+        hist = [recent[-1]] * L  # 保存していない古い分はいちばん古い値で埋める
+        for j, y in enumerate(recent):
+            hist[(h - j) % L] = y
+        self.hist_y = hist
+        self.head = h
+        self._layout()
+        return off + 2 * depth
 
     def draw(self, screen):
-        if self.should_draw():
-            screen.blit(self.image, self.rect)
+        if self.blit_seq:
+            screen.blits(self.blit_seq, doreturn=False)
 
 
 # =========================
@@ -594,27 +1517,38 @@ class Event:
         e = event_lst[random.randint(0, len(event_lst) - 1)]
         return e
 
-    def start(self, event_name: str):
+    def start(self, event_name: str, now: int):
         if event_name == "speed_up":
-            self.addspeed = 1.5
-            self.end_time = 10000
+            self.addspeed = EVENT_SPEED_UP
+            self.end_time = EVENT_DURATION_MS
         elif event_name == "speed_down":
-            self.addspeed = 0.8
-            self.end_time = 10000
+            self.addspeed = EVENT_SPEED_DOWN
+            self.end_time = EVENT_DURATION_MS
         else:
             self.addspeed = 1.0
             self.end_time = 0
 
-        self.start_time = pg.time.get_ticks()
+        self.start_time = now
         self.active = True
 
-    def update(self):
+    def update(self, now: int):
         # 一定時間経過したらリセット
-        if self.active and pg.time.get_ticks() - self.start_time > self.end_time:
+        if self.active and now - self.start_time > self.end_time:
             self.addspeed = 1.0
             self.value = ""
             self.active = False
 
+    SNAP = struct.Struct("<dBqqb")  # addspeed, active, start_time, end_time, EVENT_LSTの番号(-1=なし)
+
+    def snap(self):
+        index = EVENT_LST.index(self.value) if self.value in EVENT_LST else -1
+        return (self.addspeed, self.active, self.start_time, self.end_time, index)
+
+    def load(self, vals):
+        self.addspeed, active, self.start_time, self.end_time, index = vals
+        self.active = bool(active)
+        self.value = EVENT_LST[index] if index >= 0 else ""
+
 
 # =========================
 # ライフ＆ボーナス
@@ -636,6 +1570,14 @@ class Life:
     def is_dead(self):
         return self.life <= 0
 
+    SNAP = struct.Struct("<i")
+
+    def snap(self):
+        return (self.life,)
+
+    def load(self, vals):
+        self.life, = vals
+
     def draw(self, screen):
         heart = "♥" * self.life if self.life > 0 else ""
         img = self.font.render(f"LIFE: {heart}", True, (200, 30, 30))
@@ -644,13 +1586,34 @@ class Life:
 
 class LifeBonus(pg.sprite.Sprite):
     """残機+1ボーナス（🍄）"""
+    SNAP = struct.Struct("<iid")  # x, y, speed
+    _image = None  # 🍄の画像（全ボーナスで共有）
+
     def __init__(self, x, speed):
         super().__init__()
-        font = pg.font.SysFont("Meiryo", 48, bold=True)
-        self.image = font.render("🍄", True, (0, 200, 0), None).convert_alpha()
+        self.image = self.bonus_image()
         self.rect = self.image.get_rect(midbottom=(x, GROUND_Y))
         self.speed = speed
 
+    @classmethod
+    def bonus_image(cls):
+        if cls._image is None:
+            font = pg.font.SysFont("Meiryo", 48, bold=True)
+            cls._image = font.render("🍄", True, (0, 200, 0), None).convert_alpha()
+        return cls._image
+
+    def snap(self):
+        return (self.rect.x, self.rect.y, self.speed)
+
+    @classmethod
+    def unsnap(cls, vals):
+        x, y, speed = vals
+        self = bare_sprite(cls)
+        self.image = cls.bonus_image()
+        self.rect = self.image.get_rect(topleft=(x, y))
+        self.speed = speed
+        return self
+
     def update(self):
         self.rect.x -= self.speed
         if self.rect.right < 0:
@@ -658,380 +1621,2011 @@ class LifeBonus(pg.sprite.Sprite):
 
 
 # =========================
-# メイン
+# ラン記録＆リーダーボード
 # =========================
-def main():
-    pg.init()
-    pg.mixer.init()
+RunRecord = namedtuple(
+    "RunRecord", "score survival_ms seed timestamp lives cleared"
+)
 
-    # BGM
-    try:
-        pg.mixer.music.load("fig/BGM.wav")
-        pg.mixer.music.set_volume(0.5)
-        pg.mixer.music.play(-1)
-    except Exception as e:
-        print("BGMエラー:", e)
 
-    # 効果音
+class RunLog:
+    """
+    1プレイ(ラン)の結果を固定長バイナリで追記していくログ。
+    ・runs.bin : ヘッダ + 32バイト固定長レコードの列（追記のみ）
+    ・runs.idx : 上位N件のレコード番号 + スコア別件数(Fenwick木)
+    どちらも mmap 経由で読むので、何十万件たまっても
+    上位表示と順位計算はテキストを読み直さずに一瞬で終わる。
+    """
+    LOG_MAGIC = b"SRUNLOG1"
+    IDX_MAGIC = b"SRUNIDX1"
+    LOG_HEADER = struct.Struct("<8sI4x")     # magic, レコードサイズ
+    RECORD = struct.Struct("<iIQqBB6x")      # score, survival_ms, seed, timestamp, lives, cleared
+    IDX_HEADER = struct.Struct("<8sIIQ")     # magic, top_n, score_cap, 登録済み件数
+    TOP_SLOT = struct.Struct("<qi4x")        # レコード番号(-1で空), score
+    U32 = struct.Struct("<I")
+    SCORE_CAP = 1 << 17                      # これ以上のスコアは同じ枠で数える（順位はログで数え直す）
+
+    def __init__(self, path=RUNLOG_PATH, index_path=RUNLOG_INDEX_PATH,
+                 top_n=LEADERBOARD_TOP_N):
+        self.top_n = top_n
+        self._log_mm = None
+
+        # ログ本体（なければヘッダだけ書いて作る）
+        self._log_file = open(path, "a+b")
+        if self._log_file.seek(0, os.SEEK_END) == 0:
+            self._log_file.write(self.LOG_HEADER.pack(self.LOG_MAGIC, self.RECORD.size))
+            self._log_file.flush()
+        self._log_file.seek(0)
+        magic, rec_size = self.LOG_HEADER.unpack(self._log_file.read(self.LOG_HEADER.size))
+        if magic != self.LOG_MAGIC or rec_size != self.RECORD.size:
+            self._log_file.close()
+            raise ValueError(f"{path} はラン記録ファイルではありません")
+
+        # インデックス（固定サイズなので丸ごと mmap）
+        self._top_off = self.IDX_HEADER.size
+        self._tree_off = self._top_off + self.TOP_SLOT.size * top_n
+        idx_size = self._tree_off + self.U32.size * (self.SCORE_CAP + 2)
+        mode = "r+b" if os.path.exists(index_path) else "w+b"
+        self._idx_file = open(index_path, mode)
+        if os.fstat(self._idx_file.fileno()).st_size != idx_size:
+            self._idx_file.truncate(idx_size)
+        self._idx_mm = mmap.mmap(self._idx_file.fileno(), idx_size)
+
+        magic, n, cap, indexed = self.IDX_HEADER.unpack_from(self._idx_mm, 0)
+        if (magic != self.IDX_MAGIC or n != top_n or cap != self.SCORE_CAP
+                or indexed != len(self)):
+            self._rebuild_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        size = os.fstat(self._log_file.fileno()).st_size
+        return (size - self.LOG_HEADER.size) // self.RECORD.size
+
+    def close(self):
+        if self._log_mm is not None:
+            self._log_mm.close()
+            self._log_mm = None
+        self._idx_mm.close()
+        self._idx_file.close()
+        self._log_file.close()
+
+    # ---- ログ本体 ----
+    def _log_view(self):
+        """ログ全体の mmap（追記でサイズが変わっていたら張り直す）"""
+        size = self.LOG_HEADER.size + len(self) * self.RECORD.size
+        if self._log_mm is None or len(self._log_mm) != size:
+            if self._log_mm is not None:
+                self._log_mm.close()
+            self._log_mm = mmap.mmap(self._log_file.fileno(), size,
+                                     access=mmap.ACCESS_READ)
+        return self._log_mm
+
+    def get(self, i):
+        off = self.LOG_HEADER.size + i * self.RECORD.size
+        return RunRecord(*self.RECORD.unpack_from(self._log_view(), off))
+
+    def append(self, rec):
+        """レコードを追記してインデックスを更新し、レコード番号を返す"""
+        i = len(self)
+        self._log_file.seek(0, os.SEEK_END)
+        self._log_file.write(self.RECORD.pack(
+            rec.score, rec.survival_ms, rec.seed, rec.timestamp,
+            rec.lives, rec.cleared))
+        self._log_file.flush()
+        self._index_record(i, rec.score)
+        self.IDX_HEADER.pack_into(self._idx_mm, 0, self.IDX_MAGIC,
+                                  self.top_n, self.SCORE_CAP, i + 1)
+        return i
+
+    # ---- インデックス ----
+    def _rebuild_index(self):
+        """インデックスが壊れている/古いときにログから作り直す"""
+        self._idx_mm[:] = bytes(len(self._idx_mm))
+        for k in range(self.top_n):
+            self.TOP_SLOT.pack_into(self._idx_mm, self._top_off + k * self.TOP_SLOT.size, -1, 0)
+        view = self._log_view()
+        for i, fields in enumerate(self.RECORD.iter_unpack(view[self.LOG_HEADER.size:])):
+            self._index_record(i, fields[0])
+        self.IDX_HEADER.pack_into(self._idx_mm, 0, self.IDX_MAGIC,
+                                  self.top_n, self.SCORE_CAP, len(self))
+
+    def _index_record(self, i, score):
+        # スコア別件数（Fenwick木、添字は score+1）
+        pos = max(0, min(score, self.SCORE_CAP)) + 1
+        while pos <= self.SCORE_CAP + 1:
+            off = self._tree_off + pos * self.U32.size
+            self.U32.pack_into(self._idx_mm, off, self.U32.unpack_from(self._idx_mm, off)[0] + 1)
+            pos += pos & -pos
+
+        # 上位N件（スコア降順、同点は先に出た方が上）
+        slots = self._top_slots()
+        if len(slots) == self.top_n and score <= slots[-1][1]:
+            return
+        slots.append((i, score))
+        slots.sort(key=lambda s: (-s[1], s[0]))
+        del slots[self.top_n:]
+        for k in range(self.top_n):
+            idx, sc = slots[k] if k < len(slots) else (-1, 0)
+            self.TOP_SLOT.pack_into(self._idx_mm, self._top_off + k * self.TOP_SLOT.size, idx, sc)
+
+    def _top_slots(self):
+        slots = []
+        for k in range(self.top_n):
+            idx, sc = self.TOP_SLOT.unpack_from(self._idx_mm, self._top_off + k * self.TOP_SLOT.size)
+            if idx < 0:
+                break
+            slots.append((idx, sc))
+        return slots
+
+    def _count_at_most(self, score):
+        """スコアが score 以下のラン数"""
+        pos = max(0, min(score, self.SCORE_CAP)) + 1
+        total = 0
+        while pos > 0:
+            total += self.U32.unpack_from(self._idx_mm, self._tree_off + pos * self.U32.size)[0]
+            pos -= pos & -pos
+        return total
+
+    def top(self, n=None):
+        """上位 n 件を [(レコード番号, RunRecord), ...] で返す"""
+        slots = self._top_slots()[:n]
+        return [(i, self.get(i)) for i, _ in slots]
+
+    def rank(self, score):
+        """score が何位か（自分より高いラン数 + 1）"""
+        if score < self.SCORE_CAP:
+            return len(self) - self._count_at_most(score) + 1
+        # 上限以上のスコアは件数の木では同じ枠なので、その枠にランがあればログから数える
+        if len(self) - self._count_at_most(self.SCORE_CAP - 1) == 0:
+            return 1
+        view = self._log_view()
+        higher = sum(1 for fields in self.RECORD.iter_unpack(view[self.LOG_HEADER.size:])
+                     if fields[0] > score)
+        return higher + 1
+
+
+def record_run(rec):
+    """
+    ランを記録してリーダーボード表示用の情報を返す。
+    (上位リスト, 今回のレコード番号, 順位, 総件数)。失敗時は None。
+    """
     try:
-        jump_sound = pg.mixer.Sound("fig/janp.wav")
-        jump_sound.set_volume(0.6)
+        with RunLog() as log:
+            i = log.append(rec)
+            return log.top(), i, log.rank(rec.score), len(log)
     except Exception as e:
-        print("ジャンプ音読み込みエラー:", e)
-        jump_sound = None
+        telemetry.log("ラン記録エラー:", e)
+        return None
 
-    try:
-        stomp_sound = pg.mixer.Sound("fig/stomp.wav")
-        stomp_sound.set_volume(0.7)
-    except Exception as e:
-        print("踏みつぶし音読み込みエラー:", e)
-        stomp_sound = None
 
-    try:
-        gameover_sound = pg.mixer.Sound("fig/gameover.wav")
-        gameover_sound.set_volume(0.8)
-    except Exception as e:
-        print("ゲームオーバー音読み込みエラー:", e)
-        gameover_sound = None
+def draw_leaderboard(surface, font, board, x, y):
+    """ゲーム終了画面のリーダーボード（自分の記録は赤）"""
+    top, my_index, my_rank, total = board
+    draw_text(surface, f"RANKING ({total}件中 {my_rank}位)", font, x, y)
+    for k, (i, rec) in enumerate(top):
+        color = (200, 30, 30) if i == my_index else TEXT_COLOR
+        mark = "★" if rec.cleared else " "
+        draw_text(surface,
+                  f"{k + 1:2d}. {rec.score:6d}  {rec.survival_ms / 1000.0:6.2f}s {mark}",
+                  font, x, y + 30 * (k + 1), color)
 
-    pg.display.set_caption("CAR RUN (マリオ床ver)")
-    screen = pg.display.set_mode((WIDTH, HEIGHT))
-    clock = pg.time.Clock()
-
-    # フォント
-    FONT_NAME = "Meiryo"
-    font_big = pg.font.SysFont(FONT_NAME, 64)
-    font_small = pg.font.SysFont(FONT_NAME, 32)
-
-    # 背景
-    bg_img_raw = pg.image.load("fig/hai3.jpg").convert()
-    base_h = HEIGHT
-    base_w = int(bg_img_raw.get_width() * (base_h / bg_img_raw.get_height()))
-    HORIZ_STRETCH = 1.5
-    wide_w = int(base_w * HORIZ_STRETCH)
-    wide_h = base_h
-    bg_img = pg.transform.smoothscale(bg_img_raw, (wide_w, wide_h))
-    bg_img_flip = pg.transform.flip(bg_img, True, False)
-
-    # 車
-    raw_car = pg.image.load("fig/3.png").convert_alpha()
-    raw_car = pg.transform.flip(raw_car, True, False)  # 右向き
-    car_img = pg.transform.smoothscale(raw_car, (CAR_W, CAR_H))
-
-    # 障害物画像
-    raw_obst1 = pg.image.load("fig/4.png").convert_alpha()
-    raw_obst2 = pg.image.load("fig/5.png").convert_alpha()
-    raw_obst3 = pg.image.load("fig/bush2.png").convert_alpha()
-    obstacle_image_list = [raw_obst1, raw_obst2, raw_obst3]
 
-    # ゲームオブジェクト
-    car = Car(car_img, jump_sound)
-    obstacles = pg.sprite.Group()
-    bonus_group = pg.sprite.Group()
-    stars = pg.sprite.Group()
-    particles = pg.sprite.Group()
-    goal_group = pg.sprite.Group()
-    goal = None
-
-
-    world_speed = SPEED_START
-    floor_scroll_x = 0.0
-    bg_scroll_x = 0.0
-    start_ticks = pg.time.get_ticks()
-
-    score_obj = Score(font_small, car, car_img)
-    life_obj = Life(font_small, LIFE_INIT)
-    random_event = Event(font_small)
-
-    game_active = True
-    game_clear = False
-    end_time = None
-
-    # イベントID
-    SPAWN_EVENT = pg.USEREVENT + 1
-    BONUS_EVENT = pg.USEREVENT + 2
-    STAR_SPAWN_EVENT = pg.USEREVENT + 3
-    RANDOM_EVENT = pg.USEREVENT + 4  # ランダムイベント
-
-    # タイマー設定
-    pg.time.set_timer(SPAWN_EVENT, SPAWN_INTERVAL_MS)
-    pg.time.set_timer(BONUS_EVENT, 1000)  # 1秒ごとに🍄チャンス
-    pg.time.set_timer(STAR_SPAWN_EVENT, STAR_SPAWN_INTERVAL_MS)
-    pg.time.set_timer(RANDOM_EVENT, 40000)  # 40秒ごとにランダムイベント
-
-    tmr = 0  # デバッグ用カウンタ（今は未使用）
+# =========================
+# 入力＆統計表示
+# =========================
+def percentile(sorted_values, q):
+    """ソート済みリストの q(0〜1) 分位点"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
 
-    global current_color_index, current_block_main_color, current_block_edge_color
 
-    # =========================
-    # ループ
-    # =========================
-    while True:
-        dt = clock.tick(FPS) / 1000.0
-        key_lst = pg.key.get_pressed()
-        current_time = pg.time.get_ticks()
+class InputSystem:
+    """
+    キー入力を KEYDOWN / KEYUP イベントで受け取り、届いた時刻を付けて覚えておく。
+    ・1フレームより短い「押してすぐ離す」もジャンプとして拾う
+    ・空中で押したジャンプは JUMP_BUFFER_MS の間とっておき、着地したフレームで出す
+    ・ジャンプを押してから、それが反映されたフレームが画面に出るまでの時間を測る
+    フレーム間の待ちは pg.event.wait で行うので、押した瞬間に時刻が付く。
+    押しっぱなしの状態も同じイベントから作り、input_sys[key] でキー配列として読める
+    （pg.key.get_pressed をフレームごとに読まない）。
+    jump_keys はプレイヤーごとのジャンプのキー（2人対戦なら2つ）。
+    """
+    def __init__(self, jump_keys=(CONTROLS_SOLO[0],)):
+        self.jump_keys = jump_keys
+        self.held = set()              # 押しっぱなしのキー
+        # プレイヤーごとの、まだ反映していないジャンプ押下の時刻(perf_counter)
+        self.jump_presses = [deque() for _ in jump_keys]
+        self.frame_stamps = []         # このフレームで反映した押下の時刻
+        self.latency = deque(maxlen=INPUT_LATENCY_SAMPLES)  # 入力→表示(ミリ秒)
+
+    def __getitem__(self, key):
+        return key in self.held
+
+    def _track(self, event):
+        """押しっぱなしの状態を更新（フォーカスを失ったら全部離したことにする）"""
+        if event.type == pg.KEYDOWN:
+            self.held.add(event.key)
+        elif event.type == pg.KEYUP:
+            self.held.discard(event.key)
+        elif event.type == pg.WINDOWFOCUSLOST:
+            self.held.clear()
+
+    def _stamp(self, event, t):
+        self._track(event)
+        if event.type == pg.KEYDOWN:
+            for keys, presses in zip(self.jump_keys, self.jump_presses):
+                if event.key in keys:
+                    presses.append(t)
+
+    def collect(self, deadline):
+        """
+        deadline(perf_counter秒) まで待ちながらイベントを集めて返す。
+        deadline が過去なら待たずにたまっている分だけ返す。
+        """
+        events = []
+        while True:
+            for event in pg.event.get():
+                self._stamp(event, time.perf_counter())
+                events.append(event)
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return events
+            event = pg.event.wait(max(1, int(remaining * 1000)))
+            if event.type != pg.NOEVENT:
+                self._stamp(event, time.perf_counter())
+                events.append(event)
+
+    def wait(self, timeout_ms):
+        """
+        入力が来るか timeout_ms たつまで眠ってイベントを返す（一時停止・終了画面用）。
+        止まっている間の押下はジャンプの猶予に積まない（再開した瞬間に跳ばないように）。
+        """
+        event = pg.event.wait(max(1, int(timeout_ms)))
+        events = [] if event.type == pg.NOEVENT else [event]
+        events.extend(pg.event.get())
+        for event in events:
+            self._track(event)
+        return events
+
+    def jump_request(self, player=0):
+        """猶予時間内のジャンプ押下があるか（古いものは捨てる）"""
+        limit = time.perf_counter() - JUMP_BUFFER_MS / 1000.0
+        presses = self.jump_presses[player]
+        while presses and presses[0] < limit:
+            presses.popleft()
+        return bool(presses)
+
+    def after_step(self, car, player=0):
+        """車が実際にジャンプしたら押下を使い切り、遅延計測の対象にする"""
+        presses = self.jump_presses[player]
+        if car.jumped and presses:
+            self.frame_stamps.append(presses[0])
+            presses.clear()
+
+    def take_frame_stamps(self):
+        stamps, self.frame_stamps = self.frame_stamps, []
+        return stamps
+
+    def presented(self, stamps, t):
+        """フレームが画面に出た時刻 t を受け取って遅延を記録（描画スレッドからも呼ばれる）"""
+        for stamp in stamps:
+            self.latency.append((t - stamp) * 1000.0)
+
+    def latency_stats(self):
+        """(中央値, p99, サンプル数)（ミリ秒）"""
+        values = sorted(self.latency)
+        return percentile(values, 0.5), percentile(values, 0.99), len(values)
+
+
+class StatsOverlay:
+    """F3 で表示する統計（FPS・フレーム時間・入力遅延）"""
+    def __init__(self, font):
+        self.font = font
+        self.visible = False
+        self.frame_times = deque(maxlen=120)
+        self.last = time.perf_counter()
 
-        # ---- イベント処理 ----
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                pg.quit()
-                sys.exit()
+    def tick(self):
+        now = time.perf_counter()
+        self.frame_times.append(now - self.last)
+        self.last = now
 
-            if event.type == pg.KEYDOWN:
-                if event.key == pg.K_ESCAPE:
-                    pg.quit()
-                    sys.exit()
+    def draw(self, canvas, input_sys):
+        if not self.visible or not self.frame_times:
+            return
+        avg = sum(self.frame_times) / len(self.frame_times)
+        p50, p99, n = input_sys.latency_stats()
+        lines = [
+            f"FPS {1.0 / avg if avg > 0 else 0:.1f}  frame {avg * 1000:.1f}ms",
+            f"入力遅延 p50 {p50:.1f}ms  p99 {p99:.1f}ms  (n={n})",
+        ]
+        y = HEIGHT - 30 * len(lines) - 10
+        for line in lines:
+            draw_text(canvas, line, self.font, 10, y, (255, 255, 255))
+            y += 30
 
-                # 床の色変更：Mキー
-                if event.key == pg.K_m and game_active:
-                    current_color_index = (current_color_index + 1) % len(BLOCK_COLORS)
-                    current_block_main_color = BLOCK_COLORS[current_color_index]
-                    current_block_edge_color = BLOCK_EDGE_DEFAULT
 
-            if not game_active:
-                continue
+# =========================
+# アセット
+# =========================
+class Assets:
+    """画像・フォント・効果音をまとめて読み込む（display.set_mode の後で作る）"""
+    def __init__(self, sound=True):
+        # フォント
+        FONT_NAME = "Meiryo"
+        self.font_big = pg.font.SysFont(FONT_NAME, 64)
+        self.font_small = pg.font.SysFont(FONT_NAME, 32)
+        self.font_rank = pg.font.SysFont(FONT_NAME, 24)
+        self.font_inv = pg.font.SysFont(FONT_NAME, 24)
+
+        # 背景
+        bg_img_raw = pg.image.load(fig_path("hai3.jpg")).convert()
+        base_h = HEIGHT
+        base_w = int(bg_img_raw.get_width() * (base_h / bg_img_raw.get_height()))
+        HORIZ_STRETCH = 1.5
+        wide_w = int(base_w * HORIZ_STRETCH)
+        wide_h = base_h
+        self.bg_img = pg.transform.smoothscale(bg_img_raw, (wide_w, wide_h))
+        self.bg_img_flip = pg.transform.flip(self.bg_img, True, False)
+
+        # 車
+        raw_car = pg.image.load(fig_path("3.png")).convert_alpha()
+        raw_car = pg.transform.flip(raw_car, True, False)  # 右向き
+        self.car_img = pg.transform.smoothscale(raw_car, (CAR_W, CAR_H))
+
+        # 障害物画像
+        raw_obst1 = pg.image.load(fig_path("4.png")).convert_alpha()
+        raw_obst2 = pg.image.load(fig_path("5.png")).convert_alpha()
+        raw_obst3 = pg.image.load(fig_path("bush2.png")).convert_alpha()
+        self.obstacle_images = [raw_obst1, raw_obst2, raw_obst3]
+
+        # 効果音
+        self.sound = sound
+        self.jump_sound = None
+        self.stomp_sound = None
+        self.gameover_sound = None
+        if not sound:
+            return
 
-            if event.type == SPAWN_EVENT:
-                obstacles.add(Obstacle(obstacle_image_list, world_speed))
+        try:
+            self.jump_sound = pg.mixer.Sound(fig_path("janp.wav"))
+            self.jump_sound.set_volume(0.6)
+        except Exception as e:
+            print("ジャンプ音読み込みエラー:", e)
 
-            if event.type == BONUS_EVENT:
-                if random.random() < 0.2:
-                    bonus = LifeBonus(WIDTH + random.randint(0, 200), world_speed)
-                    bonus_group.add(bonus)
+        try:
+            self.stomp_sound = pg.mixer.Sound(fig_path("stomp.wav"))
+            self.stomp_sound.set_volume(0.7)
+        except Exception as e:
+            print("踏みつぶし音読み込みエラー:", e)
 
-            if event.type == STAR_SPAWN_EVENT:
-                stars.add(StarItem(obstacles))
+        try:
+            self.gameover_sound = pg.mixer.Sound(fig_path("gameover.wav"))
+            self.gameover_sound.set_volume(0.8)
+        except Exception as e:
+            print("ゲームオーバー音読み込みエラー:", e)
 
-            if event.type == RANDOM_EVENT:
-                event_name = random_event.select(EVENT_LST)
-                random_event.set(event_name)
-                random_event.start(event_name)
 
-        # --- ロジック更新 ---
-        if game_active:
-            # ランダムイベントの効果更新
-            random_event.update()
+# =========================
+# ゲーム世界
+# =========================
+class Player:
+    """World の中の1人ぶん（車・スコア・残機）。2人対戦では2人いる"""
+    SNAP = struct.Struct("<Bq")  # まだ走っているか, 脱落した時刻(-1=なし)
 
-            elapsed_sec = (current_time - start_ticks) / 1000.0
+    def __init__(self, assets, controls=CONTROLS_SOLO):
+        self.car = Car(assets.car_img, assets.jump_sound, controls)
+        self.score_obj = Score(assets.font_small, self.car, assets.car_img)
+        self.life_obj = Life(assets.font_small, LIFE_INIT)
+        self.alive = True
+        self.out_time = None  # 残機がなくなった時刻
 
-            # スピードだんだん上がる + イベント補正
-            world_speed = (SPEED_START + SPEED_ACCEL * elapsed_sec) * random_event.addspeed
+    def snap(self):
+        return (self.alive, -1 if self.out_time is None else self.out_time)
 
-            bg_scroll_x -= world_speed
-            floor_scroll_x -= world_speed
+    def load(self, vals):
+        alive, out_time = vals
+        self.alive = bool(alive)
+        self.out_time = None if out_time < 0 else out_time
 
-            obstacles.update(world_speed)
-            bonus_group.update()
-            stars.update(world_speed)
-            particles.update()
 
-            # 足場を計算してから車を更新
-            car.floor_y = get_support_y(car.rect, obstacles)
-            destroy_flag = car.update(key_lst)
-            car.update_invincible(current_time)
+class World:
+    """
+    1プレイぶんのゲーム状態とロジック。
+    時刻 now(ミリ秒) とキー状態を渡して step() で1フレーム進める。
+    タイマーも now で管理するので、画面なしで時刻を進めても同じ展開になる
+    （同じシードなら同じ結果）。
+    players=2 なら2人対戦（障害物・アイテム・イベントは共通、車・スコア・残機は別々）。
+    """
+    def __init__(self, assets, now, players=1):
+        self.assets = assets
+        controls = [CONTROLS_SOLO] if players == 1 else CONTROLS_VERSUS[:players]
+        self.players = [Player(assets, c) for c in controls]
+        self.obstacles = pg.sprite.Group()
+        self.bonus_group = pg.sprite.Group()
+        self.stars = pg.sprite.Group()
+        self.particles = pg.sprite.Group()
+        self.goal_group = pg.sprite.Group()
+        self.goal = None
+        self.ghosts = None  # GhostRace（あればプレイヤーより奥に描く）
+
+        self.world_speed = SPEED_START
+        self.floor_scroll_x = 0.0
+        self.bg_scroll_x = 0.0
+        self.start_ticks = now
+
+        self.random_event = Event(assets.font_small)
+
+        self.game_active = True
+        self.game_clear = False
+        self.end_time = None
+        self.death_cause = None  # 最後にぶつかった障害物の種類など
+        self.winner = None       # 2人対戦で勝ったプレイヤーの番号
+
+        # タイマー（次に発生する時刻）
+        self.next_spawn = now + SPAWN_INTERVAL_MS
+        self.next_bonus = now + BONUS_INTERVAL_MS
+        self.next_star = now + STAR_SPAWN_INTERVAL_MS
+        self.next_event = now + EVENT_INTERVAL_MS
+
+    # 1人プレイ用（2人対戦では P1）
+    @property
+    def car(self):
+        return self.players[0].car
+
+    @property
+    def score_obj(self):
+        return self.players[0].score_obj
+
+    @property
+    def life_obj(self):
+        return self.players[0].life_obj
+
+    def _play(self, sound, name):
+        if sound is not None:
+            try:
+                sound.play()
+            except Exception as e:
+                telemetry.log(f"{name}エラー:", e)
+
+    def _finish(self, now, clear, winner=None):
+        self.game_active = False
+        self.game_clear = clear
+        self.end_time = now
+        if len(self.players) > 1:
+            if winner is None:
+                # ゴールした人がいなければスコアの高いほうが勝ち（同点は引き分け）
+                scores = [p.score_obj.value for p in self.players]
+                best = max(scores)
+                if scores.count(best) == 1:
+                    winner = scores.index(best)
+            self.winner = winner
+        if self.assets.sound:
+            pg.mixer.music.fadeout(1000)
+
+    def _timers(self, now):
+        """出現タイマー（ゲーム中だけ進む）"""
+        t = now - self.start_ticks
+
+        if now >= self.next_spawn:
+            self.next_spawn += SPAWN_INTERVAL_MS
+            self.obstacles.add(Obstacle(self.assets.obstacle_images, self.world_speed))
+
+        if now >= self.next_bonus:
+            self.next_bonus += BONUS_INTERVAL_MS
+            if random.random() < BONUS_CHANCE:
+                bonus = LifeBonus(WIDTH + random.randint(0, 200), self.world_speed)
+                self.bonus_group.add(bonus)
+
+        if now >= self.next_star:
+            self.next_star += STAR_SPAWN_INTERVAL_MS
+            self.stars.add(StarItem(self.obstacles))
+
+        if now >= self.next_event:
+            self.next_event += EVENT_INTERVAL_MS
+            event_name = self.random_event.select(EVENT_LST)
+            self.random_event.set(event_name)
+            self.random_event.start(event_name, now)
+            telemetry.emit(TEL_EVENT, t, EVENT_LST.index(event_name))
+
+    def step(self, now, key_lst, jump_request=False):
+        """
+        1フレーム進める（ゲーム終了後は何もしない）。
+        jump_request はイベントで届いたジャンプ押下（InputSystem から）。
+        2人対戦ではプレイヤーごとのリストで渡す。
+        """
+        if not self.game_active:
+            return
+        if not isinstance(jump_request, (list, tuple)):
+            jump_request = [jump_request]
+        self._timers(now)
+
+        particles = self.particles
+        t = now - self.start_ticks
+
+        # ランダムイベントの効果更新
+        self.random_event.update(now)
+
+        elapsed_sec = t / 1000.0
+
+        # スピードだんだん上がる + イベント補正
+        world_speed = (SPEED_START + SPEED_ACCEL * elapsed_sec) * self.random_event.addspeed
+        self.world_speed = world_speed
+
+        self.bg_scroll_x -= world_speed
+        self.floor_scroll_x -= world_speed
+
+        self.obstacles.update(world_speed)
+        self.bonus_group.update()
+        self.stars.update(world_speed)
+        particles.update()
+
+        # 2人対戦でも処理の順番で有利不利が出ないように、全員の車を動かしてから
+        # アイテムを配り、障害物は全員が片付けるまで消さない（_clear_obstacle）
+        alive = [(i, p) for i, p in enumerate(self.players) if p.alive]
+        destroy_flags = []
+        for i, player in alive:
+            jump = jump_request[i] if i < len(jump_request) else False
+            destroy_flags.append(self._move_player(i, player, now, key_lst, jump))
+        self._pickups(alive, now, t)
+        for (i, player), destroy_flag in zip(alive, destroy_flags):
+            self._hit_player(i, player, now, t, destroy_flag)
+
+        # 全員のスコアが出そろってから終了を決める
+        if not any(p.alive for p in self.players):
+            self._finish(now, clear=False)
+            self._play(self.assets.gameover_sound, "ゲームオーバー音")
+
+        # ゴーストの再生
+        if self.ghosts is not None:
+            self.ghosts.update()
+
+        # ★ ゴール旗の出現＆判定 ★
+        # スコアがGOAL_SCOREになったら、右側に旗を出す
+        best = max(p.score_obj.value for p in self.players)
+        if self.goal is None and best >= GOAL_SCORE:
+            self.goal = Goal(WIDTH + 150, GROUND_Y)
+            self.goal_group.add(self.goal)
+
+        # ゴール旗の移動
+        self.goal_group.update(world_speed)
+
+        # プレイヤーのX座標が、旗のX座標を超えたらクリア扱い
+        # （同じティックに何人も着いたら勝者は _finish がスコアで決める）
+        if self.game_active and self.goal:
+            arrived = [i for i, p in alive
+                       if p.alive and p.car.rect.centerx >= self.goal.rect.centerx]
+            if arrived:
+                self.death_cause = "goal"
+                self._finish(now, clear=True,
+                             winner=arrived[0] if len(arrived) == 1 else None)
+                for i in arrived:
+                    telemetry.emit(TEL_GOAL, t, 0, self.players[i].score_obj.value, player=i)
+
+    def _clear_obstacle(self, obs, i):
+        """
+        プレイヤー i が障害物を片付けた（踏んだ・ぶつかった・壊した）。
+        障害物は全員で共有なので、生きている全員が片付けるまでは本当には壊さない。
+        """
+        obs.cleared |= 1 << i
+        if all(obs.cleared >> j & 1 for j, p in enumerate(self.players) if p.alive):
+            obs.destroy(self.particles)
+
+    def _move_player(self, i, player, now, key_lst, jump_request):
+        """1人ぶんの車を動かし、Shift が押されたかを返す"""
+        car = player.car
+        obstacles = self.obstacles
+        if len(self.players) > 1:
+            obstacles = [obs for obs in obstacles if not obs.is_gone_for(i)]
+
+        # 足場を計算してから車を更新
+        car.floor_y = get_support_y(car.rect, obstacles)
+        destroy_flag = car.update(key_lst, jump_request)
+        car.update_invincible(now)
+        return destroy_flag
+
+    def _pickups(self, alive, now, t):
+        """スター・きのこ（同じティックに触れた人は全員が取れる）"""
+        taken = set()
+        for i, player in alive:
+            car = player.car
 
             # スター取得
-            if pg.sprite.spritecollide(car, stars, True):
-                car.activate_invincible(current_time)
+            stars = pg.sprite.spritecollide(car, self.stars, False)
+            if stars:
+                taken.update(stars)
+                car.activate_invincible(now)
+                telemetry.emit(TEL_STAR, t, player=i)
 
             # きのこ取得 → ライフ+1
-            if pg.sprite.spritecollide(car, bonus_group, True):
-                life_obj.increase()
-                score_obj.bonus("life_up")
-
-            # Shiftで前方の一番近い障害物を破壊
-            if destroy_flag and score_obj.destroy_count > 0:
-                closest_obstacle = None
-                min_x = WIDTH * 2
-                for obs in obstacles:
-                    if obs.is_destroyed:
-                        continue
-                    if obs.rect.left > car.rect.right and obs.rect.right < min_x:
-                        min_x = obs.rect.right
-                        closest_obstacle = obs
-                if closest_obstacle and score_obj.use_destroy():
-                    closest_obstacle.destroy(particles)
-                    score_obj.bonus("obstacle_break")
-
-            # 障害物との当たり判定
-            side_hit = False
-
-            for obs in obstacles:
-                if obs.is_destroyed:
+            bonuses = pg.sprite.spritecollide(car, self.bonus_group, False)
+            if bonuses:
+                taken.update(bonuses)
+                player.life_obj.increase()
+                player.score_obj.bonus("life_up")
+                telemetry.emit(TEL_MUSHROOM, t, 0, player.life_obj.life, player=i)
+        for sprite in taken:
+            sprite.kill()
+
+    def _end_of_tick_hits(self, car, i):
+        """
+        rect / mask モードの接触を障害物の順に1つずつ (ny, 障害物) で返す。
+        その都度判定するので、前の障害物を踏んだ跳ね返りや足場への着地が次の判定に効く（従来どおり）。
+        """
+        for obs in self.obstacles:
+            if obs.is_gone_for(i):
+                continue
+            contact = car_contact(car, obs)
+            if contact is not None:
+                yield contact[2], obs
+
+    def _hit_player(self, i, player, now, t, destroy_flag):
+        """1人ぶんの Shift 破壊・障害物との当たり判定・スコア"""
+        car = player.car
+        score_obj = player.score_obj
+        life_obj = player.life_obj
+
+        # Shiftで前方の一番近い障害物を破壊
+        if destroy_flag and score_obj.destroy_count > 0:
+            closest_obstacle = None
+            min_x = WIDTH * 2
+            for obs in self.obstacles:
+                if obs.is_gone_for(i):
                     continue
-                if not car.rect.colliderect(obs.rect):
+                if obs.rect.left > car.rect.right and obs.rect.right < min_x:
+                    min_x = obs.rect.right
+                    closest_obstacle = obs
+            if closest_obstacle and score_obj.use_destroy():
+                self._clear_obstacle(closest_obstacle, i)
+                score_obj.bonus("obstacle_break")
+                telemetry.emit(TEL_DESTROY, t, closest_obstacle.kind,
+                               score_obj.destroy_count, player=i)
+
+        # 障害物との当たり判定
+        side_hit = False
+
+        if COLLISION_MODE == "swept":
+            # ティック内で早く当たった順に処理
+            contacts = []
+            for obs in self.obstacles:
+                if obs.is_gone_for(i):
                     continue
-
-                landed_from_above = (
-                    car.vel_y >= 0 and
-                    car.rect.bottom <= obs.rect.top + 20
-                )
-
-                if landed_from_above:
-                    if obs.is_stompable():
-                        obs.destroy(particles)
-                        score_obj.add(STOMP_SCORE)
-                        car.vel_y = BOUNCE_VELOCITY
-                        if stomp_sound is not None:
-                            try:
-                                stomp_sound.play()
-                            except Exception as e:
-                                print("踏みつぶし音エラー:", e)
-                    elif obs.is_platform():
-                        car.floor_y = obs.rect.top
-                        car.rect.bottom = obs.rect.top
-                        car.vel_y = 0.0
-                    else:
-                        if not car.is_invincible:
-                            side_hit = True
+                contact = car_contact(car, obs)
+                if contact is not None:
+                    contacts.append((contact[0], contact[2], obs))
+            contacts.sort(key=lambda c: c[0])
+            hits = [(ny, obs) for _, ny, obs in contacts]
+        else:
+            hits = self._end_of_tick_hits(car, i)
+
+        for ny, obs in hits:
+            landed_from_above = ny < 0
+
+            if landed_from_above:
+                if obs.is_stompable():
+                    if COLLISION_MODE == "swept":
+                        car.rect.bottom = obs.rect.top  # すり抜けた分を接触位置に戻す
+                    self._clear_obstacle(obs, i)
+                    score_obj.add(STOMP_SCORE)
+                    car.vel_y = BOUNCE_VELOCITY
+                    telemetry.emit(TEL_STOMP, t, obs.kind, score_obj.value, player=i)
+                    self._play(self.assets.stomp_sound, "踏みつぶし音")
+                elif obs.is_platform():
+                    car.floor_y = obs.rect.top
+                    car.rect.bottom = obs.rect.top
+                    car.vel_y = 0.0
                 else:
-                    # 横・下から衝突
                     if not car.is_invincible:
                         side_hit = True
-                    else:
-                        # 無敵中はぶつかると破壊
-                        obs.destroy(particles)
-
-                if side_hit and not car.is_invincible:
-                    obs.destroy(particles)
-                    life_obj.decrease()
-                    if life_obj.is_dead():
-                        game_active = False
-                        game_clear = False
-                        end_time = current_time
-                        pg.mixer.music.fadeout(1000)
-                        if gameover_sound is not None:
-                            try:
-                                gameover_sound.play()
-                            except Exception as e:
-                                print("ゲームオーバー音エラー:", e)
-                    break
-
-            # 時間ベーススコア
-            time_score = int((current_time - start_ticks) / 10)
-            if score_obj.value < time_score:
-                score_obj.set(time_score)
-
-            # 仲間カーの管理
-            score_obj.check_for_friends()
-            score_obj.update_friends(key_lst)
-
-            # ★ ゴール旗の出現＆判定 ★
-            # スコアがGOAL_SCOREになったら、右側に旗を出す
-            if goal is None and score_obj.value >= GOAL_SCORE:
-                goal = Goal(WIDTH + 150, GROUND_Y)
-                goal_group.add(goal)
-
-            # ゴール旗の移動
-            goal_group.update(world_speed)
-
-            # プレイヤーのX座標が、旗のX座標を超えたらクリア扱い
-            if goal and car.rect.centerx >= goal.rect.centerx:
-                game_active = False
-                game_clear = True
-                end_time = current_time
-                pg.mixer.music.fadeout(1000)
-
-           
-
-        else:
-            # ゲームオーバー/クリア後 5秒で終了
-            if end_time is not None and current_time - end_time >= GAMEOVER_EXIT_DELAY_MS:
-                pg.quit()
-                sys.exit()
-
-        # ---- 描画 ----
-        draw_bg_scroll(screen, bg_img, bg_img_flip, bg_scroll_x)
-        draw_floor_tiles(screen, floor_scroll_x)
-
-        bonus_group.draw(screen)
-        for star in stars:
-            star.draw(screen)
-        particles.draw(screen)
+            else:
+                # 横・下から衝突
+                if not car.is_invincible:
+                    side_hit = True
+                else:
+                    # 無敵中はぶつかると破壊
+                    self._clear_obstacle(obs, i)
+
+            if side_hit and not car.is_invincible:
+                self._clear_obstacle(obs, i)
+                life_obj.decrease()
+                telemetry.emit(TEL_SIDE_HIT, t, obs.kind, life_obj.life, player=i)
+                if life_obj.is_dead():
+                    self.death_cause = f"obstacle{obs.kind}"
+                    player.alive = False
+                    player.out_time = now
+                break
+
+        # 時間ベーススコア
+        time_score = int(t / 10)
+        if score_obj.value < time_score:
+            score_obj.set(time_score)
+
+        # ゲームオーバーはこのティックのスコアが出そろってから記録する（ラン記録と同じ値）
+        if not player.alive:
+            telemetry.emit(TEL_DEATH, t, 0, score_obj.value, player=i)
+
+        # 仲間カーの管理
+        score_obj.check_for_friends()
+        score_obj.update_friends()
+
+    # ---- スナップショット ----
+    # 時刻, start_ticks, end_time(-1=なし), 出現タイマー×4, world_speed, 床と背景のスクロール,
+    # game_active, game_clear, 床の色番号, 死因の長さ, 勝者(-1=なし), 人数
+    SNAP = struct.Struct("<qqqqqqqdddBBBBbB")
+    COUNTS = struct.Struct("<HHHHB")  # 障害物, パーティクル, スター, きのこ, ゴール旗
+
+    def save_state(self, now):
+        """乱数以外の全状態を1つのバイト列にする（now はこの状態の時刻）"""
+        cause = (self.death_cause or "").encode()
+        groups = (self.obstacles, self.particles, self.stars, self.bonus_group,
+                  self.goal_group)
+        parts = [
+            self.SNAP.pack(
+                now, self.start_ticks,
+                -1 if self.end_time is None else self.end_time,
+                self.next_spawn, self.next_bonus, self.next_star, self.next_event,
+                self.world_speed, self.floor_scroll_x, self.bg_scroll_x,
+                self.game_active, self.game_clear, current_color_index, len(cause),
+                -1 if self.winner is None else self.winner, len(self.players)),
+            cause,
+            Event.SNAP.pack(*self.random_event.snap()),
+        ]
+        for player in self.players:
+            parts += [
+                Player.SNAP.pack(*player.snap()),
+                Car.SNAP.pack(*player.car.snap()),
+                Score.SNAP.pack(*player.score_obj.snap()),
+                Life.SNAP.pack(*player.life_obj.snap()),
+                player.score_obj.friends.pack(),
+            ]
+        parts.append(self.COUNTS.pack(*map(len, groups)))
+        for group, cls in zip(groups, (Obstacle, Particle, StarItem, LifeBonus, Goal)):
+            pack = cls.SNAP.pack
+            parts.extend(pack(*sprite.snap()) for sprite in group)
+        return b"".join(parts)
+
+    def load_state(self, buf):
+        """save_state() の中身に戻し、その時刻 now を返す"""
+        global current_color_index, current_block_main_color, current_block_edge_color
+        (now, self.start_ticks, end_time, self.next_spawn, self.next_bonus,
+         self.next_star, self.next_event, self.world_speed, self.floor_scroll_x,
+         self.bg_scroll_x, game_active, game_clear, color_index,
+         cause_len, winner, n_players) = self.SNAP.unpack_from(buf, 0)
+        off = self.SNAP.size
+        self.end_time = None if end_time < 0 else end_time
+        self.game_active = bool(game_active)
+        self.game_clear = bool(game_clear)
+        self.winner = None if winner < 0 else winner
+        if n_players != len(self.players):
+            raise ValueError("スナップショットの人数が違います")
+        self.death_cause = bytes(buf[off:off + cause_len]).decode() or None
+        off += cause_len
+        current_color_index = color_index
+        current_block_main_color = BLOCK_COLORS[color_index]
+        current_block_edge_color = BLOCK_EDGE_DEFAULT
+
+        self.random_event.load(Event.SNAP.unpack_from(buf, off))
+        off += Event.SNAP.size
+        for player in self.players:
+            for obj, st in ((player, Player.SNAP), (player.car, Car.SNAP),
+                            (player.score_obj, Score.SNAP), (player.life_obj, Life.SNAP)):
+                obj.load(st.unpack_from(buf, off))
+                off += st.size
+            off = player.score_obj.friends.unpack_from(buf, off)
+
+        counts = self.COUNTS.unpack_from(buf, off)
+        off += self.COUNTS.size
+        loaded = []
+        for n, cls in zip(counts, (Obstacle, Particle, StarItem, LifeBonus, Goal)):
+            st = cls.SNAP
+            vals = [st.unpack_from(buf, off + i * st.size) for i in range(n)]
+            off += n * st.size
+            if cls is Obstacle:
+                images = self.assets.obstacle_images
+                loaded.append([cls.unsnap(v, images) for v in vals])
+            else:
+                loaded.append([cls.unsnap(v) for v in vals])
+
+        for group, sprites in zip((self.obstacles, self.particles, self.stars,
+                                   self.bonus_group, self.goal_group), loaded):
+            group.empty()
+            group.add(*sprites)
+        self.goal = loaded[-1][0] if loaded[-1] else None
+        return now
+
+    def snapshot(self, now):
+        """乱数の状態も含めた完全なスナップショット（先読み・巻き戻し用）"""
+        return pack_rng() + self.save_state(now)
+
+    def restore(self, buf):
+        """snapshot() の状態に戻し、その時刻 now を返す"""
+        buf = memoryview(buf)
+        unpack_rng(buf[:SNAP_RNG.size])
+        return self.load_state(buf[SNAP_RNG.size:])
+
+    def draw(self, canvas, now):
+        """背景からHUDまで描く（終了画面のテキストは呼び出し側）"""
+        self.draw_layers(canvas)
+        self.draw_sprites(canvas, self.players)
+        self.draw_hud(canvas, now)
+
+    def draw_layers(self, canvas):
+        """背景と床（2人対戦では1回だけ描いて両方の表示で使い回す）"""
+        assets = self.assets
+        draw_bg_scroll(canvas, assets.bg_img, assets.bg_img_flip, self.bg_scroll_x)
+        draw_floor_tiles(canvas, self.floor_scroll_x)
+
+    def draw_sprites(self, canvas, players):
+        """アイテム・ゴースト・車・障害物・ゴール旗（車と仲間は players の分だけ）"""
+        self.bonus_group.draw(canvas)
+        for star in self.stars:
+            star.draw(canvas)
+        for particle in self.particles:
+            particle.draw(canvas)
+
+        # ゴースト（プレイヤーより奥）
+        if self.ghosts is not None:
+            self.ghosts.draw(canvas)
 
         # プレイヤー＆仲間
-        car.draw(screen)
-        score_obj.draw_friends(screen)
+        for player in players:
+            player.car.draw(canvas)
+            player.score_obj.draw_friends(canvas)
+
+        # 障害物（2人対戦の各表示では、その人が片付けたものは描かない）
+        hidden = 0
+        if len(players) < len(self.players):
+            for player in players:
+                hidden |= 1 << self.players.index(player)
+        for obs in self.obstacles:
+            if not obs.cleared & hidden:
+                obs.draw(canvas)
 
-        # 障害物
-        for obs in obstacles:
-            obs.draw(screen)
-        
         # ゴール旗
-        goal_group.draw(screen)
+        self.goal_group.draw(canvas)
 
+    def draw_hud(self, canvas, now):
+        """1人プレイのHUD（スコア・ライフ・無敵時間・イベント名）"""
+        assets = self.assets
+        car = self.car
 
         # スコア＆ライフ
-        score_obj.draw(screen)
-        life_obj.draw(screen)
+        self.score_obj.draw(canvas)
+        self.life_obj.draw(canvas)
 
         # 無敵残り時間表示
         if car.is_invincible:
-            invincible_font = pg.font.SysFont("Meiryo", 24)
             remaining_time = max(
                 0,
-                STAR_DURATION_MS - (current_time - car.invincible_start_time)
+                STAR_DURATION_MS - (now - car.invincible_start_time)
             ) / 1000.0
-            inv_text = invincible_font.render(
+            inv_text = assets.font_inv.render(
                 f"無敵時間: {remaining_time:.1f}s", True, (255, 255, 0)
             )
-            screen.blit(inv_text, (WIDTH - 220, 20))
+            canvas.blit(inv_text, (WIDTH - 220, 20))
 
         # イベント名表示
-        random_event.draw(screen)
+        self.random_event.draw(canvas)
+
+
+def draw_end_screen(canvas, world, assets, leaderboard):
+    """ゲームオーバー / ゴール表示"""
+    font_big = assets.font_big
+    font_small = assets.font_small
+    end_time = world.end_time
+    start_ticks = world.start_ticks
+    if world.game_clear:
+        # ゴールしたとき
+        draw_text(canvas, "GOAL!!", font_big,
+                  WIDTH // 2 - 130, HEIGHT // 2 - 120)
+        if end_time is not None:
+            survival_sec = (end_time - start_ticks) / 1000.0
+            draw_text(canvas,
+                      f"Time: {survival_sec:.2f} s",
+                      font_small,
+                      WIDTH // 2 - 90,
+                      HEIGHT // 2 - 50)
+        draw_text(canvas,
+                  "クリア！おつかれさま！",
+                  font_small,
+                  WIDTH // 2 - 130,
+                  HEIGHT // 2 + 10)
+        draw_text(canvas,
+                  "5秒後に終了します / ESCで即終了",
+                  font_small,
+                  WIDTH // 2 - 200,
+                  HEIGHT // 2 + 50)
+    else:
+        # ゲームオーバー
+        draw_text(canvas, "GAME OVER", font_big,
+                  WIDTH // 2 - 200, HEIGHT // 2 - 120)
+
+        if end_time is not None:
+            survival_sec = (end_time - start_ticks) / 1000.0
+            draw_text(canvas,
+                      f"Time: {survival_sec:.2f} s",
+                      font_small,
+                      WIDTH // 2 - 90,
+                      HEIGHT // 2 - 50)
+
+        draw_text(canvas,
+                  "5秒後に終了します",
+                  font_small,
+                  WIDTH // 2 - 120,
+                  HEIGHT // 2 + 10)
+
+        draw_text(canvas,
+                  "ESCで今すぐ終了",
+                  font_small,
+                  WIDTH // 2 - 110,
+                  HEIGHT // 2 + 50)
+
+    if leaderboard:
+        draw_leaderboard(canvas, assets.font_rank, leaderboard,
+                         WIDTH - 330, 130)
+
+
+def draw_pause_screen(canvas, assets):
+    """一時停止の表示"""
+    draw_text(canvas, "PAUSE", assets.font_big,
+              WIDTH // 2 - 100, HEIGHT // 2 - 120)
+    draw_text(canvas, "Pキーで再開 / ESCで終了", assets.font_small,
+              WIDTH // 2 - 170, HEIGHT // 2 - 30)
 
-        # ゲームオーバー / ゴール表示
-        if not game_active:
-            if game_clear:
-                # ゴールしたとき
-                draw_text(screen, "GOAL!!", font_big,
-                          WIDTH // 2 - 130, HEIGHT // 2 - 120)
-                if end_time is not None:
-                    survival_sec = (end_time - start_ticks) / 1000.0
-                    draw_text(screen,
-                              f"Time: {survival_sec:.2f} s",
-                              font_small,
-                              WIDTH // 2 - 90,
-                              HEIGHT // 2 - 50)
-                draw_text(screen,
-                          "クリア！おつかれさま！",
-                          font_small,
-                          WIDTH // 2 - 130,
-                          HEIGHT // 2 + 10)
-                draw_text(screen,
-                          "5秒後に終了します / ESCで即終了",
-                          font_small,
-                          WIDTH // 2 - 200,
-                          HEIGHT // 2 + 50)
+
+# =========================
+# 2人対戦（上下分割）
+# =========================
+class OffsetCanvas:
+    """
+    描き先の座標を縦に dy ずらして surface に描く（分割画面のカメラ用）。
+    Surface と同じ blit / blits / fill を持つので、World の描画からは普通の Surface に見える。
+    """
+    def __init__(self, surface, dy):
+        self.surface = surface
+        self.dy = dy
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        return self.surface.blit(source, (dest[0], dest[1] + self.dy), area, special_flags)
+
+    def blits(self, blit_sequence, doreturn=True):
+        dy = self.dy
+        seq = [(item[0], (item[1][0], item[1][1] + dy)) + tuple(item[2:])
+               for item in blit_sequence]
+        return self.surface.blits(seq, doreturn=doreturn)
+
+    def fill(self, color, rect=None):
+        if rect is not None:
+            rect = pg.Rect(rect).move(0, self.dy)
+        return self.surface.fill(color, rect)
+
+
+class SplitView:
+    """
+    2人対戦の上下分割表示（上が P1、下が P2）。
+    ・プレイヤーごとの表示は画面の subsurface（描いたものがそのまま画面に出る）
+    ・背景と床は1フレームに1回だけ P1 の表示に描き、P2 の表示には映る行が重なる分を
+      コピーして使い回す（重ならない行だけ描き足す）
+    ・カメラは縦にだけ動き、ジャンプした車が見切れないように追う
+    """
+    def __init__(self, screen, players):
+        self.screen = screen
+        self.views = [screen.subsurface((0, i * VERSUS_VIEW_H, WIDTH, VERSUS_VIEW_H))
+                      for i in range(players)]
+        self.cam_y = [float(HEIGHT - VERSUS_VIEW_H)] * players
+
+    def _camera(self, i, car):
+        """表示 i の上端のワールド座標（地面にいるときは画面の下端まで見せる）"""
+        base = HEIGHT - VERSUS_VIEW_H
+        target = max(0, min(base, car.rect.top - VERSUS_CAMERA_MARGIN))
+        cam = self.cam_y[i] + (target - self.cam_y[i]) * VERSUS_CAMERA_EASE
+        cam = max(0, min(cam, car.rect.top))  # 車の頭は必ず見える
+        self.cam_y[i] = cam
+        return int(cam)
+
+    def _draw_layers(self, world, cams):
+        H = VERSUS_VIEW_H
+        base_view, base_cam = self.views[0], cams[0]
+        world.draw_layers(OffsetCanvas(base_view, -base_cam))
+        for i, (view, cam) in enumerate(zip(self.views[1:], cams[1:]), 1):
+            lo = max(cam, base_cam)
+            hi = min(cam, base_cam) + H
+            if hi <= lo:
+                missing = (0, 0, WIDTH, H)
             else:
-                # ゲームオーバー
-                draw_text(screen, "GAME OVER", font_big,
-                          WIDTH // 2 - 200, HEIGHT // 2 - 120)
-
-                if end_time is not None:
-                    survival_sec = (end_time - start_ticks) / 1000.0
-                    draw_text(screen,
-                              f"Time: {survival_sec:.2f} s",
-                              font_small,
-                              WIDTH // 2 - 90,
-                              HEIGHT // 2 - 50)
-
-                draw_text(screen,
-                          "5秒後に終了します",
-                          font_small,
-                          WIDTH // 2 - 120,
-                          HEIGHT // 2 + 10)
-
-                draw_text(screen,
-                          "ESCで今すぐ終了",
-                          font_small,
-                          WIDTH // 2 - 110,
-                          HEIGHT // 2 + 50)
+                # 兄弟の subsurface 同士は blit できないので親（画面）の中でコピーする
+                self.screen.blit(self.screen, (0, i * H + lo - cam),
+                                 (0, lo - base_cam, WIDTH, hi - lo))
+                if hi - lo == H:
+                    continue
+                if cam < base_cam:
+                    missing = (0, 0, WIDTH, lo - cam)
+                else:
+                    missing = (0, hi - cam, WIDTH, H - (hi - cam))
+            view.set_clip(missing)
+            world.draw_layers(OffsetCanvas(view, -cam))
+            view.set_clip(None)
+
+    def draw(self, world, now):
+        cams = [self._camera(i, p.car) for i, p in enumerate(world.players)]
+        self._draw_layers(world, cams)
+        for i, (view, player) in enumerate(zip(self.views, world.players)):
+            world.draw_sprites(OffsetCanvas(view, -cams[i]), (player,))
+            self._draw_hud(view, world, player, i, now)
+
+        # 境目の線
+        self.views[0].fill((0, 0, 0), (0, VERSUS_VIEW_H - 2, WIDTH, 2))
+
+    def _draw_hud(self, view, world, player, i, now):
+        assets = world.assets
+        score_obj = player.score_obj
+        draw_text(view, f"P{i + 1}  SCORE: {score_obj.value}", assets.font_small, 20, 10)
+        heart = "♥" * player.life_obj.life
+        draw_text(view, f"LIFE: {heart}  Shift: {score_obj.destroy_count}",
+                  assets.font_small, 20, 45, (200, 30, 30))
+        world.random_event.draw(view)
+
+        car = player.car
+        if car.is_invincible:
+            remaining_time = max(
+                0,
+                STAR_DURATION_MS - (now - car.invincible_start_time)
+            ) / 1000.0
+            inv_text = assets.font_inv.render(
+                f"無敵時間: {remaining_time:.1f}s", True, (255, 255, 0)
+            )
+            view.blit(inv_text, (WIDTH - 220, 10))
 
-        pg.display.update()
+        if not player.alive:
+            draw_text(view, "OUT", assets.font_big, WIDTH // 2 - 60, VERSUS_VIEW_H // 2 - 40)
+
+
+def draw_versus_result(canvas, world, assets):
+    """2人対戦の結果（2つの表示の境目に重ねる）"""
+    text = "DRAW" if world.winner is None else f"P{world.winner + 1} WIN!"
+    draw_text(canvas, text, assets.font_big, WIDTH // 2 - 130, HEIGHT // 2 - 60)
+    draw_text(canvas, "5秒後に終了します / ESCで即終了", assets.font_small,
+              WIDTH // 2 - 200, HEIGHT // 2 + 20)
+
+
+# =========================
+# スナップショットと巻き戻し
+# =========================
+SNAP_RNG = struct.Struct("<625IBd")  # random の状態（MT の624語+位置, gauss の持ち越し）
+
+
+def pack_rng():
+    version, internal, gauss_next = random.getstate()
+    return SNAP_RNG.pack(*internal, gauss_next is not None, gauss_next or 0.0)
+
+
+def unpack_rng(buf):
+    vals = SNAP_RNG.unpack(buf)
+    random.setstate((3, vals[:625], vals[626] if vals[625] else None))
+
+
+def bare_sprite(cls):
+    """__init__ を通さずにスプライトを作る（復元用、乱数を消費しない）"""
+    self = cls.__new__(cls)
+    pg.sprite.Sprite.__init__(self)
+    return self
+
+
+class Rewind:
+    """
+    直近 REWIND_SEC 秒ぶんのスナップショットを毎ティック取っておくリング。
+    乱数の状態（約2.5KB）は変わらない間は前のものを共有するので、
+    1ティックあたりはほぼ World.save_state() の大きさで済む。
+    """
+    def __init__(self, seconds=REWIND_SEC, fps=FPS):
+        self.ring = deque(maxlen=int(seconds * fps))
+        self.last_rng = None
+
+    def push(self, world, now):
+        rng = pack_rng()
+        if rng == self.last_rng:
+            rng = self.last_rng
+        else:
+            self.last_rng = rng
+        self.ring.append((rng, world.save_state(now)))
+
+    def rewind(self, world):
+        """いちばん古いスナップショットに戻し、その時刻を返す（なければ None）"""
+        if not self.ring:
+            return None
+        rng, state = self.ring[0]
+        self.ring.clear()
+        self.last_rng = None
+        unpack_rng(rng)
+        return world.load_state(state)
+
+    def nbytes(self):
+        """リングが使っているバイト数（共有している乱数の状態は1回だけ数える）"""
+        rngs = {id(rng): len(rng) for rng, _ in self.ring}
+        return sum(rngs.values()) + sum(len(state) for _, state in self.ring)
+
+
+# =========================
+# メモリ診断
+# =========================
+def surface_bytes(surf):
+    """Surface のピクセルが使っているバイト数"""
+    return surf.get_pitch() * surf.get_height()
+
+
+class MemoryMonitor:
+    """
+    長時間プレイでメモリが増えていないかを調べる（--memdiag）。
+    ・tracemalloc のスナップショットで Python 側の増加を行単位で出す
+    ・生きている Surface のピクセルを系統（アセット・障害物・パーティクル・HUD文字…）ごとに合計
+    ・グループから外れたのにどこかから参照されて残っているスプライトを数える
+    同じ値が MEMDIAG_WINDOW 回続けて増えていたら警告を出す。
+    出力は telemetry.log 経由（ゲームスレッドで print しない）。
+    """
+    SPRITE_TYPES = ("Obstacle", "Particle", "StarItem", "LifeBonus", "Goal")
+
+    def __init__(self, world, now):
+        self.world = world
+        self.next_report = now + MEMDIAG_INTERVAL_MS
+        self.history = {}  # 値の名前 → 直近の値
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+
+    def _surfaces(self):
+        """系統ごとの (Surface の数, バイト数)。同じ Surface は最初の系統だけで数える"""
+        world = self.world
+        assets = world.assets
+        systems = {
+            "assets": [assets.bg_img, assets.bg_img_flip, assets.car_img,
+                       *assets.obstacle_images, *_floor_strip_cache.values()],
+            "obstacle_cache": [img for img, _ in _obstacle_img_cache.values()],
+            "obstacles": [s for obs in world.obstacles
+                          for s in (obs.image, obs.original_image)],
+            "particles": [p.image for p in world.particles],
+            "items": [spr.image for g in (world.stars, world.bonus_group, world.goal_group)
+                      for spr in g],
+        }
+        if world.ghosts is not None:
+            systems["assets"].append(world.ghosts.image)
+
+        # HUD の文字は毎フレーム作り直されるので、1フレームぶん描いて残りを数える
+        frame = DrawList()
+        world.draw(frame, world.start_ticks)
+        hud = []
+        for op, a, _, _, _ in frame.ops:
+            if op == OP_BLITS:
+                hud.extend(item[0] for item in a)
+            elif op != OP_FILL:
+                hud.append(a)
+        systems["hud_text"] = hud
+
+        seen = set()
+        result = {}
+        for name, surfs in systems.items():
+            count = size = 0
+            for surf in surfs:
+                if id(surf) in seen:
+                    continue
+                seen.add(id(surf))
+                count += 1
+                size += surface_bytes(surf)
+            result[name] = (count, size)
+        return result
+
+    def _orphans(self):
+        """ワールドのどのグループにも入っていないのに生きているスプライトの数"""
+        world = self.world
+        members = set()
+        for g in (world.obstacles, world.particles, world.stars,
+                  world.bonus_group, world.goal_group):
+            members.update(map(id, g))
+        counts = dict.fromkeys(self.SPRITE_TYPES, 0)
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            if name in counts and isinstance(obj, pg.sprite.Sprite) and id(obj) not in members:
+                counts[name] += 1
+        return counts
+
+    def _track(self, name, value):
+        """値の履歴を残し、ずっと増え続けていれば True"""
+        hist = self.history.setdefault(name, deque(maxlen=MEMDIAG_WINDOW + 1))
+        hist.append(value)
+        return (len(hist) == hist.maxlen and
+                all(a < b for a, b in zip(hist, list(hist)[1:])))
+
+    def sample(self, now):
+        """MEMDIAG_INTERVAL_MS ごとにレポートを出す（毎フレーム呼んでよい）"""
+        if now < self.next_report:
+            return
+        self.next_report = now + MEMDIAG_INTERVAL_MS
+        world = self.world
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        diff = snapshot.compare_to(self.snapshot, "lineno")
+        self.snapshot = snapshot
+
+        lines = [f"[MEM {(now - world.start_ticks) / 1000.0:.0f}s] "
+                 f"python={current / 1e6:.2f}MB (peak {peak / 1e6:.2f}MB)"]
+        growing = []
+        if self._track("python", current):
+            growing.append("python")
+
+        for name, (count, size) in self._surfaces().items():
+            lines.append(f"  {name:15s} {count:5d} surf {size / 1e6:8.2f}MB")
+            if self._track(f"{name}.surf", count):
+                growing.append(f"{name}(数)")
+            if self._track(f"{name}.bytes", size):
+                growing.append(f"{name}(バイト)")
+
+        groups = {
+            "obstacles": len(world.obstacles),
+            "particles": len(world.particles),
+            "stars": len(world.stars),
+            "bonus": len(world.bonus_group),
+            "convoy": len(world.score_obj.friends),
+            "ghosts": len(world.ghosts.tracks) if world.ghosts is not None else 0,
+        }
+        lines.append("  groups: " + " ".join(f"{k}={v}" for k, v in groups.items()))
+        for name, n in groups.items():
+            if self._track(f"group.{name}", n):
+                growing.append(f"group.{name}")
+
+        orphans = self._orphans()
+        lines.append("  orphans: " + " ".join(f"{k}={v}" for k, v in orphans.items()))
+        for name, n in orphans.items():
+            if self._track(f"orphan.{name}", n):
+                growing.append(f"orphan.{name}")
+
+        for stat in diff[:MEMDIAG_TOP_LINES]:
+            if stat.size_diff > 0:
+                frame = stat.traceback[0]
+                lines.append(f"  +{stat.size_diff / 1e3:8.1f}KB "
+                             f"{os.path.basename(frame.filename)}:{frame.lineno}")
+
+        if growing:
+            lines.append(f"  ⚠ {MEMDIAG_WINDOW}回続けて増加: " + ", ".join(growing))
+        telemetry.log("\n".join(lines))
+
+
+# =========================
+# 外部連携（共有メモリの観測リング）
+# =========================
+# レイアウト（リトルエンディアン・固定長）
+#   0   ヘッダ        OBS_HEADER（最新の seq はここ）
+#   64  操作チャネル  OBS_ACTION（外部 → ゲーム、書くのは外部の1プロセスだけ）
+#   128 リング        OBS_RING_SLOTS 個のスロット
+# スロット = 先頭seq + OBS_FRAME + 障害物 × OBS_MAX_OBSTACLES + 末尾seq
+# 書き手は 先頭seq → 中身 → 末尾seq の順に書くので、読み手は
+# 先頭と末尾の seq が一致したときだけ採用すればロックなしで読める。
+OBS_MAGIC = b"SROBS001"
+OBS_HEADER = struct.Struct("<8sIIIIQ")  # magic, slots, slot_size, max_obstacles, 書き手のpid, 最新seq
+OBS_ACTION = struct.Struct("<QQQI4xQ")  # 先頭seq, 応答したフレームseq, 送信時刻ns, ビット, 末尾seq
+OBS_FRAME = struct.Struct(
+    "<QQiihhhhfhhfbBBBBBHQB")
+# seq(上と共通), 公開時刻ns(perf_counter), プレイ時間ms, スコア,
+# 車 x, y, w, h, vel_y, 足場の高さ, 残機, スクロール速度,
+# イベント(EVENT_LSTの番号 / -1), イベント中, ゲーム中, クリア, 無敵, 接地,
+# 破壊ストック, 反映済みの操作seq, 障害物の数
+OBS_OBSTACLE = struct.Struct("<hhhhBB")  # x, y, w, h, kind, フラグ
+OBS_SEQ = struct.Struct("<Q")
+OBS_HEADER_SIZE = 64
+OBS_ACTION_OFFSET = 64
+OBS_ACTION_TAIL = OBS_ACTION_OFFSET + OBS_ACTION.size - OBS_SEQ.size
+OBS_RING_OFFSET = 128
+OBS_SLOT_SIZE = (OBS_SEQ.size + OBS_FRAME.size + OBS_OBSTACLE.size * OBS_MAX_OBSTACLES
+                 + OBS_SEQ.size + 63) // 64 * 64
+OBS_SLOT_TAIL = OBS_SLOT_SIZE - OBS_SEQ.size
+
+OBS_DESTROYED = 1   # 障害物フラグ
+OBS_STOMPABLE = 2
+OBS_PLATFORM = 4
+
+ACT_JUMP = 1        # 操作ビット: ジャンプ押下（新しい操作ごとに1回）
+ACT_SHIFT = 2       # 操作ビット: Shift 破壊
+
+Observation = namedtuple("Observation", [
+    "seq", "pub_ns", "t_ms", "score", "car_x", "car_y", "car_w", "car_h", "vel_y",
+    "floor_y", "lives", "world_speed", "event", "event_active", "game_active",
+    "game_clear", "invincible", "on_ground", "destroy_count", "action_ack", "obstacles",
+])
+ObsObstacle = namedtuple("ObsObstacle", "x y w h kind flags")
+
+
+def obs_shm_size(slots=OBS_RING_SLOTS):
+    return OBS_RING_OFFSET + slots * OBS_SLOT_SIZE
+
+
+def pid_alive(pid):
+    """pid のプロセスが生きているか（Windows では共有メモリが残らないので常に True）"""
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def obs_ring_is_stale(name, wait=OBS_STALE_SEC):
+    """
+    name の観測リングが強制終了したゲームの残りなら True。
+    ヘッダの書き手 pid が死んでいれば残り。pid がなければ wait 秒 seq が進まないかで判定する。
+    観測リングでない共有メモリなら FileExistsError。
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # 調べるだけなので終了時に消されないようにする（3.12以前）
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    try:
+        if shm.size < OBS_HEADER.size:
+            raise FileExistsError(f"共有メモリ {name} は観測リングではありません")
+        magic, _, _, _, pid, seq = OBS_HEADER.unpack_from(shm.buf, 0)
+        if magic != OBS_MAGIC:
+            raise FileExistsError(f"共有メモリ {name} は観測リングではありません")
+        if pid:
+            return not pid_alive(pid)
+        time.sleep(wait)
+        return OBS_HEADER.unpack_from(shm.buf, 0)[5] == seq
+    finally:
+        shm.close()
+
+
+class ActionKeys:
+    """
+    キー状態に外部からの操作を重ねたもの。
+    Car.handle_input からは普通のキー配列に見える。
+    Shift は操作する車の destroy_keys（2人対戦なら P1 の右 Shift）として押す。
+    """
+    def __init__(self, key_lst, bits, destroy_keys=CONTROLS_SOLO[1]):
+        self.key_lst = key_lst
+        self.bits = bits
+        self.destroy_keys = destroy_keys
+
+    def __getitem__(self, key):
+        if key in self.destroy_keys and self.bits & ACT_SHIFT:
+            return True
+        return self.key_lst[key]
+
+
+class ObsPublisher:
+    """
+    毎ティックのゲーム状態を共有メモリのリングに書く（--publish）。
+    外部のボットや分析プロセスは ObsReader で読む。pickle もソケットも使わない。
+    """
+    def __init__(self, name=OBS_SHM_NAME, slots=OBS_RING_SLOTS):
+        self.slots = slots
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=obs_shm_size(slots))
+        except FileExistsError:
+            # 強制終了したゲームの残りだけ作り直す（動いているゲームのリングは奪わない）
+            if not obs_ring_is_stale(name):
+                raise FileExistsError(
+                    f"観測リング {name} は他のゲームが使用中です"
+                    "（--publish で別の名前を指定してください）") from None
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=obs_shm_size(slots))
+        self.buf = self.shm.buf
+        self.seq = 0
+        self.action_seq = 0     # 最後に受け取った操作の seq
+        self.action_bits = 0
+        self.obs_pack = [0] * (OBS_MAX_OBSTACLES * 6)
+        OBS_HEADER.pack_into(self.buf, 0, OBS_MAGIC, slots, OBS_SLOT_SIZE,
+                             OBS_MAX_OBSTACLES, os.getpid(), 0)
+        self.obs_struct = struct.Struct(
+            "<" + OBS_OBSTACLE.format[1:] * OBS_MAX_OBSTACLES)
+        atexit.register(self.close)
+
+    def poll_action(self):
+        """
+        新しい操作があれば取り込み、(ビット, 新しい操作か) を返す。
+        書き手とは逆に 末尾seq → 中身 → 先頭seq の順に読み、両方が同じときだけ使う
+        （違えば書きかけか途中で次の操作に上書きされたので、前の操作のまま）。
+        """
+        buf = self.buf
+        end = OBS_SEQ.unpack_from(buf, OBS_ACTION_TAIL)[0]
+        bits = OBS_ACTION.unpack_from(buf, OBS_ACTION_OFFSET)[3]
+        begin = OBS_SEQ.unpack_from(buf, OBS_ACTION_OFFSET)[0]
+        if begin != end or begin == self.action_seq:
+            return self.action_bits, False
+        self.action_seq = begin
+        self.action_bits = bits
+        return bits, True
+
+    def publish(self, world, now):
+        """world の状態を次のスロットに書く"""
+        buf = self.buf
+        self.seq = seq = self.seq + 1
+        off = OBS_RING_OFFSET + (seq % self.slots) * OBS_SLOT_SIZE
+        car = world.car
+        cr = car.rect
+        event = world.random_event
+
+        vals = self.obs_pack
+        n = 0
+        for obs in world.obstacles:
+            if n == OBS_MAX_OBSTACLES:
+                break
+            r = obs.rect
+            flags = ((OBS_DESTROYED if obs.is_gone_for(0) else 0)
+                     | (OBS_STOMPABLE if obs.is_stompable() else 0)
+                     | (OBS_PLATFORM if obs.is_platform() else 0))
+            vals[n * 6:n * 6 + 6] = (r.x, r.y, r.w, r.h, obs.kind, flags)
+            n += 1
+
+        OBS_SEQ.pack_into(buf, off, seq)
+        OBS_FRAME.pack_into(
+            buf, off, seq, time.perf_counter_ns(), now - world.start_ticks,
+            world.score_obj.value, cr.x, cr.y, cr.w, cr.h, car.vel_y,
+            car.floor_y, world.life_obj.life, world.world_speed,
+            EVENT_LST.index(event.value) if event.value in EVENT_LST else -1,
+            event.active, world.game_active, world.game_clear,
+            car.is_invincible, car.on_ground(), world.score_obj.destroy_count,
+            self.action_seq, n)
+        self.obs_struct.pack_into(buf, off + OBS_FRAME.size, *vals)
+        OBS_SEQ.pack_into(buf, off + OBS_SLOT_TAIL, seq)
+        OBS_SEQ.pack_into(buf, OBS_HEADER.size - OBS_SEQ.size, seq)
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.buf = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = None
+
+
+class ObsReader:
+    """
+    ObsPublisher のリングを読む側（外部プロセス用）。
+        reader = ObsReader()
+        obs = reader.wait()             # 次のフレームまで待つ
+        reader.send(ACT_JUMP, obs.seq)  # 操作を返す
+    """
+    def __init__(self, name=OBS_SHM_NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        try:
+            # 読み手が終了したときに共有メモリを消されないようにする（3.12以前）
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        except Exception:
+            pass
+        self.buf = self.shm.buf
+        magic, self.slots, slot_size, max_obs, _, _ = OBS_HEADER.unpack_from(self.buf, 0)
+        if magic != OBS_MAGIC or slot_size != OBS_SLOT_SIZE or max_obs != OBS_MAX_OBSTACLES:
+            raise ValueError("観測リングの形式が違います")
+        self.last_seq = 0
+        self.action_seq = OBS_SEQ.unpack_from(self.buf, OBS_ACTION_OFFSET)[0]
+
+    def latest_seq(self):
+        return OBS_SEQ.unpack_from(self.buf, OBS_HEADER.size - OBS_SEQ.size)[0]
+
+    def read(self, seq):
+        """
+        seq のフレームを返す（上書き済み・書きかけなら None）。
+        書き手とは逆に 末尾seq → 中身 → 先頭seq の順に読む。末尾が seq なら書き終わっていて、
+        読んだ後も先頭が seq なら、その間に次の周回の書き込みは始まっていない。
+        """
+        buf = self.buf
+        off = OBS_RING_OFFSET + (seq % self.slots) * OBS_SLOT_SIZE
+        if OBS_SEQ.unpack_from(buf, off + OBS_SLOT_TAIL)[0] != seq:
+            return None
+        vals = OBS_FRAME.unpack_from(buf, off)
+        n = min(vals[-1], OBS_MAX_OBSTACLES)  # 途中で上書きされても範囲外は読まない
+        obstacles = [ObsObstacle._make(OBS_OBSTACLE.unpack_from(
+            buf, off + OBS_FRAME.size + i * OBS_OBSTACLE.size)) for i in range(n)]
+        if OBS_SEQ.unpack_from(buf, off)[0] != seq:
+            return None
+        return Observation(*vals[:-1], obstacles)
+
+    def latest(self):
+        """いちばん新しいフレーム（まだなければ None）"""
+        while True:
+            seq = self.latest_seq()
+            if seq == 0:
+                return None
+            obs = self.read(seq)
+            if obs is not None:
+                self.last_seq = seq
+                return obs
+
+    def wait(self, timeout=1.0, spin=0.0002):
+        """前回読んだものより新しいフレームが出るまで待って返す（時間切れは None）"""
+        limit = time.perf_counter() + timeout
+        while self.latest_seq() == self.last_seq:
+            if time.perf_counter() >= limit:
+                return None
+            time.sleep(spin)
+        return self.latest()
+
+    def send(self, bits, frame_seq=0):
+        """操作を書く（先頭seq → 中身 → 末尾seq の順）"""
+        self.action_seq += 1
+        seq = self.action_seq
+        OBS_SEQ.pack_into(self.buf, OBS_ACTION_OFFSET, seq)
+        OBS_ACTION.pack_into(self.buf, OBS_ACTION_OFFSET, seq, frame_seq,
+                             time.perf_counter_ns(), bits, seq)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+# =========================
+# 画面なし実行（自動プレイ）
+# =========================
+FRAME_MS = 1000.0 / FPS   # 画面なし実行での1フレームの時間
+HEADLESS_MAX_SEC = 360    # 画面なし実行の打ち切り時間（秒、ゴールに届く長さ）
+
+
+def policy_scripted(world, keys, rng):
+    """前方の障害物が近づいたらジャンプし、破壊ストックがあれば Shift も使う"""
+    car = world.car
+    reach = world.world_speed * 14  # だいたいジャンプの滞空ぶん
+    near = False
+    for obs in world.obstacles:
+        if obs.is_destroyed:
+            continue
+        gap = obs.rect.left - car.rect.right
+        if 0 <= gap < reach:
+            near = True
+            break
+    # 押しっぱなしだと2回目のジャンプが出ないので、地面にいる間に一度離す
+    keys[pg.K_SPACE] = near and not keys[pg.K_SPACE]
+    keys[pg.K_LSHIFT] = near and world.score_obj.destroy_count > 0
+
+
+def policy_random(world, keys, rng):
+    """ランダムにジャンプする（比較用）"""
+    keys[pg.K_SPACE] = rng.random() < 0.05
+    keys[pg.K_LSHIFT] = rng.random() < 0.01
+
+
+POLICIES = {"scripted": policy_scripted, "random": policy_random}
+
+
+def init_headless():
+    """画面・音なしで pygame を初期化して Assets を返す"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pg.display.init()
+    pg.font.init()
+    pg.display.set_mode((1, 1))
+    return Assets(sound=False)
+
+
+def run_headless(assets, seed, policy="scripted", max_sec=HEADLESS_MAX_SEC,
+                 on_frame=None):
+    """
+    シード固定で1プレイを画面なしで最後まで回し、結果を dict で返す。
+    時刻は実時間ではなく 1フレーム = FRAME_MS として進める。
+    on_frame(world, now) を渡すと毎フレームの更新後に呼ぶ（書き出しなど）。
+    """
+    random.seed(seed)
+    rng = random.Random(seed ^ 0x5EED)  # 操作用（ゲーム側の乱数とは別）
+    policy_fn = POLICIES[policy]
+    keys = defaultdict(bool)
+    world = World(assets, 0)
+    frame = 0
+    max_frames = int(max_sec * 1000 / FRAME_MS)
+    while world.game_active and frame < max_frames:
+        frame += 1
+        policy_fn(world, keys, rng)
+        now = int(frame * FRAME_MS)
+        world.step(now, keys)
+        if on_frame is not None:
+            on_frame(world, now)
+    survival_ms = (world.end_time if world.end_time is not None
+                   else int(frame * FRAME_MS)) - world.start_ticks
+    return {
+        "seed": seed,
+        "score": world.score_obj.value,
+        "survival_ms": survival_ms,
+        "lives": world.life_obj.life,
+        "cleared": world.game_clear,
+        "cause": world.death_cause or "timeout",
+    }
+
+
+# =========================
+# メイン
+# =========================
+def main(pipelined=False, fps=FPS, max_frames=0, record=True, memdiag=False,
+         publish=None, backend="surface", versus=False):
+    """
+    ゲーム本体。
+    pipelined  : 描画を別スレッドに任せ、次フレームのロジックと重ねる
+    fps        : フレームレート上限（0で無制限、ベンチマーク用）
+    max_frames : 0以外ならそのフレーム数で終了して平均FPSを表示
+    record     : ラン記録・ゴースト・テレメトリを保存する
+    memdiag    : メモリ診断レポートを定期的に出す
+    publish    : 共有メモリの名前を渡すと毎ティックの状態を公開し、外部の操作も受け付ける
+    backend    : "surface"（Surface に blit）か "texture"（SDL2 の Renderer / Texture）
+    versus     : 2人対戦（上下分割、ラン記録とゴーストはなし）
+    """
+    # ラン記録・ゴースト・テレメトリはゲームのフォルダに置く
+    # （import しただけでは作業フォルダを変えない。sweep.py などの出力先がずれないように）
+    os.chdir(BASE_DIR)
+
+    pg.init()
+    pg.mixer.init()
+
+    # 乱数シード（ラン記録に残して同じ展開を再現できるようにする）
+    seed = random.randrange(1 << 32)
+    random.seed(seed)
+
+    # テレメトリ（書き込みは裏スレッド）
+    if record:
+        try:
+            telemetry.start(TELEMETRY_PATH, seed)
+        except Exception as e:
+            print("テレメトリ開始エラー:", e)
+
+    # BGM
+    try:
+        pg.mixer.music.load(fig_path("BGM.wav"))
+        pg.mixer.music.set_volume(0.5)
+        pg.mixer.music.play(-1)
+    except Exception as e:
+        print("BGMエラー:", e)
+
+    pg.display.set_caption("CAR RUN (マリオ床ver)")
+
+    if versus and (pipelined or backend != "surface"):
+        print("2人対戦は画面の subsurface に直接描くので --pipelined / --backend は使いません")
+        pipelined, backend = False, "surface"
+    controls = CONTROLS_VERSUS if versus else [CONTROLS_SOLO]
+    n_players = len(controls)
+
+    # 入力（イベント＋時刻）と統計表示
+    input_sys = InputSystem([c[0] for c in controls])
+    presenter = None
+    if backend == "texture":
+        # 画像の convert 用に見えない画面を作り、描画は SDL2 のウィンドウで行う
+        screen = pg.display.set_mode((1, 1), pg.HIDDEN)
+        try:
+            presenter = TextureBackend((WIDTH, HEIGHT), "CAR RUN (マリオ床ver)",
+                                       input_sys.presented)
+            print("Texture描画:", "ハードウェア" if presenter.accelerated else "ソフトウェア")
+        except Exception as e:
+            print("Texture描画エラー（Surface描画にします）:", e)
+    if presenter is None:
+        screen = pg.display.set_mode((WIDTH, HEIGHT))
+        if pipelined:
+            presenter = Presenter(screen, input_sys.presented)
+
+    # 画像・フォント・効果音
+    assets = Assets(sound=True)
+
+    # ゲームオブジェクト
+    world = World(assets, pg.time.get_ticks(), n_players)
+    split = SplitView(screen, n_players) if versus else None
+
+    # ゴースト（過去のラン）と今回の軌跡の記録（1人プレイのみ）
+    ghosts = ghost_rec = None
+    if not versus:
+        world.ghosts = ghosts = GhostRace(assets.car_img)
+        ghost_rec = GhostRecorder(seed)
+
+    memory = MemoryMonitor(world, pg.time.get_ticks()) if memdiag else None
+    stats = StatsOverlay(assets.font_rank)
+
+    publisher = None
+    if publish:
+        try:
+            publisher = ObsPublisher(publish)
+        except Exception as e:
+            print("観測リング作成エラー:", e)
+
+    leaderboard = None  # 終了時に記録して表示するランキング
+
+    # 巻き戻し（R キー）。戻した分だけゲーム内の時刻を実時間からずらす
+    rewind = Rewind()
+    time_offset = 0
+
+    # 一時停止（P キー / ウィンドウが裏に回ったとき）。止めていた分も time_offset に足す
+    paused_at = None   # 止めた時刻（pg.time.get_ticks）、動いている間は None
+    idle_frame = None  # 一時停止・終了画面を焼き付けたフレーム（あれば描き直さない）
+
+    tmr = 0  # フレームカウンタ（max_frames の判定に使う）
+    bench_start = time.perf_counter()
+    frame_sec = 1.0 / fps if fps > 0 else 0.0
+    next_frame = bench_start  # 次のフレームを始める時刻（perf_counter）
+
+    global current_color_index, current_block_main_color, current_block_edge_color
+
+    # =========================
+    # ループ
+    # =========================
+    while True:
+        if idle_frame is not None:
+            # 止まっている間は入力が来るまで眠る（終了画面は自動終了の時刻には起きる）
+            timeout = IDLE_WAIT_MS
+            if paused_at is None and world.end_time is not None:
+                elapsed = pg.time.get_ticks() - time_offset - world.end_time
+                timeout = min(timeout, GAMEOVER_EXIT_DELAY_MS - elapsed)
+            events = input_sys.wait(timeout)
+        else:
+            # 次のフレームの時刻まで入力イベントを待ちながら集める
+            events = input_sys.collect(next_frame)
+            next_frame = max(next_frame + frame_sec, time.perf_counter())
+            stats.tick()
+
+        current_time = pg.time.get_ticks()
+        exposed = False  # 焼き付けたフレームを出し直す必要があるか
+
+        # ---- イベント処理 ----
+        for event in events:
+            if event.type in (pg.QUIT, pg.WINDOWCLOSE):
+                quit_game(presenter)
+
+            # ウィンドウが裏に回ったら一時停止
+            if event.type == pg.WINDOWFOCUSLOST and world.game_active and paused_at is None:
+                paused_at = current_time
+                pg.mixer.music.pause()
+
+            if event.type == pg.WINDOWEXPOSED:
+                exposed = True
+
+            if event.type == pg.KEYDOWN:
+                if event.key == pg.K_ESCAPE:
+                    quit_game(presenter)
+
+                # キーで表示が変わるかもしれないので、止まっていても1回描き直す
+                idle_frame = None
+
+                # 一時停止／再開：Pキー
+                if event.key == pg.K_p and world.game_active:
+                    if paused_at is None:
+                        paused_at = current_time
+                        pg.mixer.music.pause()
+                    else:
+                        time_offset += current_time - paused_at
+                        paused_at = None
+                        pg.mixer.music.unpause()
+                        stats.last = time.perf_counter()  # 止めていた間は FPS に数えない
+
+                # 統計表示切替：F3キー
+                if event.key == pg.K_F3:
+                    stats.visible = not stats.visible
+
+                # 巻き戻し：Rキー（REWIND_SEC 秒前に戻る）
+                if event.key == pg.K_r and world.game_active:
+                    rewound_to = rewind.rewind(world)
+                    if rewound_to is not None:
+                        clock = current_time if paused_at is None else paused_at
+                        time_offset = clock - rewound_to
+
+                # ゴースト表示切替：Gキー
+                if event.key == pg.K_g and ghosts is not None:
+                    ghosts.visible = not ghosts.visible
+
+                # 床の色変更：Mキー
+                if event.key == pg.K_m and world.game_active:
+                    current_color_index = (current_color_index + 1) % len(BLOCK_COLORS)
+                    current_block_main_color = BLOCK_COLORS[current_color_index]
+                    current_block_edge_color = BLOCK_EDGE_DEFAULT
+
+        world_time = (current_time if paused_at is None else paused_at) - time_offset
+
+        # ゲームオーバー/クリア後 5秒で終了
+        if world.end_time is not None and world_time - world.end_time >= GAMEOVER_EXIT_DELAY_MS:
+            quit_game(presenter)
+
+        # 止まっていて画面も描いてあれば、眠る前に必要なら出し直すだけ
+        idle = paused_at is not None or not world.game_active
+        if idle and idle_frame is not None:
+            if exposed:
+                present_frame(idle_frame, screen, presenter)
+            continue
+
+        # --- ロジック更新 ---
+        if paused_at is not None:
+            pass  # 一時停止中は進めない
+        elif world.game_active:
+            key_lst = input_sys  # イベントから作った押しっぱなしの状態
+            if publisher is not None:
+                # 外部からの操作を P1（観測しているのと同じ車）のキー入力に重ねる
+                # （ジャンプは押下と同じく猶予つき）
+                bits, new_action = publisher.poll_action()
+                key_lst = ActionKeys(key_lst, bits, world.car.destroy_keys)
+                if new_action and bits & ACT_JUMP:
+                    input_sys.jump_presses[0].append(time.perf_counter())
+            world.step(world_time, key_lst,
+                       [input_sys.jump_request(i) for i in range(n_players)])
+            for i, player in enumerate(world.players):
+                input_sys.after_step(player.car, i)
+            rewind.push(world, world_time)
+
+            # 軌跡の記録
+            if ghost_rec is not None:
+                ghost_rec.record(world.car.rect)
+
+            if memory is not None:
+                memory.sample(current_time)
+
+        else:
+            # 終了した最初のフレームでランを記録
+            if record and not versus and leaderboard is None and world.end_time is not None:
+                ended_at = int(time.time())
+                leaderboard = record_run(RunRecord(
+                    score=world.score_obj.value,
+                    survival_ms=world.end_time - world.start_ticks,
+                    seed=seed,
+                    timestamp=ended_at,
+                    lives=world.life_obj.life,
+                    cleared=int(world.game_clear),
+                )) or False
+                try:
+                    ghost_rec.save(ghost_path(seed, ended_at))
+                    prune_ghosts()
+                except Exception as e:
+                    telemetry.log("ゴースト保存エラー:", e)
+
+        if publisher is not None:
+            publisher.publish(world, world_time)
+
+        # ---- 描画 ----
+        # パイプライン時は命令を記録するだけ（描くのは描画スレッド）
+        canvas = DrawList() if presenter is not None else screen
+
+        if split is not None:
+            split.draw(world, world_time)
+        else:
+            world.draw(canvas, world_time)
+
+        # ゲームオーバー / ゴール表示
+        if not world.game_active:
+            if versus:
+                draw_versus_result(canvas, world, assets)
+            else:
+                draw_end_screen(canvas, world, assets, leaderboard)
+        elif paused_at is not None:
+            draw_pause_screen(canvas, assets)
+
+        stats.draw(canvas, input_sys)
+
+        if idle:
+            # 止まった画面は1枚に焼き付け、以後は描き直さない
+            idle_frame = bake_frame(canvas if presenter is not None else screen)
+            if presenter is not None:
+                canvas = DrawList()
+                canvas.blit(idle_frame, (0, 0))
+
+        stamps = input_sys.take_frame_stamps()
+        if presenter is not None:
+            canvas.input_stamps = stamps
+            presenter.submit(canvas)
+        else:
+            pg.display.update()
+            if stamps:
+                input_sys.presented(stamps, time.perf_counter())
         tmr += 1
 
+        if max_frames and tmr >= max_frames:
+            sec = time.perf_counter() - bench_start
+            stats = f"frames={tmr} sec={sec:.3f} fps={tmr / sec:.1f}"
+            if isinstance(presenter, TextureBackend):
+                stats += f" uploads={presenter.uploads}"
+            print(stats)
+            quit_game(presenter)
+
+
+def run_benchmark(frames):
+    """直列ループ・パイプライン描画・Texture描画を別プロセスで同じフレーム数だけ回して比べる"""
+    results = {}
+    for name, extra in (("serial", []), ("pipelined", ["--pipelined"]),
+                        ("texture", ["--backend", "texture"])):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             "--fps", "0", "--frames", str(frames), "--no-record", *extra],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        line = [l for l in out.splitlines() if l.startswith("frames=")][-1]
+        results[name] = float(line.split("fps=")[1].split()[0])
+        print(f"{name:10s} {line}")
+    for name in ("pipelined", "texture"):
+        print(f"{name:10s} x{results[name] / results['serial']:.2f}（serial 比）")
+
+
+def run_collision_benchmark(seeds, max_sec=60):
+    """
+    当たり判定の方式ごとに同じシードの自動プレイを画面なしで回して比べる。
+    tick_us は1ティック全体、contact_us はそのうち車と障害物の判定だけ
+    （毎ティックの更新後に同じ判定をもう一度測る）。方式でプレイの展開も変わるので結果も並べる。
+    """
+    global COLLISION_MODE
+    assets = init_headless()
+    default = COLLISION_MODE
+    run_headless(assets, 0, max_sec=max_sec)  # 画像・マスクのキャッシュを先に作っておく
+    print(f"{'mode':6s} {'ticks':>8s} {'tick_us':>8s} {'contact_us':>10s} "
+          f"{'surv_avg':>8s} {'score_avg':>9s}")
+    for mode in COLLISION_MODES:
+        COLLISION_MODE = mode
+        stat = {"ticks": 0, "contact": 0.0}
+
+        def measure(world, now):
+            car = world.car
+            t0 = time.perf_counter()
+            for obs in world.obstacles:
+                if not obs.is_destroyed:
+                    car_contact(car, obs)
+            stat["contact"] += time.perf_counter() - t0
+            stat["ticks"] += 1
+
+        t0 = time.perf_counter()
+        results = [run_headless(assets, seed, max_sec=max_sec, on_frame=measure)
+                   for seed in range(seeds)]
+        ticks = stat["ticks"]
+        tick_us = (time.perf_counter() - t0 - stat["contact"]) / ticks * 1e6
+        contact_us = stat["contact"] / ticks * 1e6
+        surv = sum(r["survival_ms"] for r in results) / len(results) / 1000.0
+        score = sum(r["score"] for r in results) / len(results)
+        print(f"{mode:6s} {ticks:8d} {tick_us:8.1f} {contact_us:10.2f} "
+              f"{surv:8.1f} {score:9.0f}")
+    COLLISION_MODE = default
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Super こうかとん Run")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="描画を別スレッドで行い次フレームのロジックと重ねる")
+    parser.add_argument("--fps", type=int, default=FPS,
+                        help="フレームレート上限（0で無制限）")
+    parser.add_argument("--frames", type=int, default=0,
+                        help="指定フレームで終了して平均FPSを表示")
+    parser.add_argument("--no-record", action="store_true",
+                        help="ラン記録・ゴースト・テレメトリを保存しない")
+    parser.add_argument("--memdiag", action="store_true",
+                        help="メモリ使用量を系統ごとに定期レポートする")
+    parser.add_argument("--backend", choices=("surface", "texture"), default="surface",
+                        help="描画方式（texture は SDL2 の Renderer / Texture）")
+    parser.add_argument("--versus", action="store_true",
+                        help="2人対戦（上下分割、P1: ↑ / 右Shift、P2: W / 左Shift）")
+    parser.add_argument("--publish", nargs="?", const=OBS_SHM_NAME, metavar="NAME",
+                        help="ゲーム状態を共有メモリで公開し外部から操作できるようにする")
+    parser.add_argument("--convoy", action="store_true",
+                        help="コンボイモード（スコアに応じて仲間がどんどん増える）")
+    parser.add_argument("--collision", choices=COLLISION_MODES, default=COLLISION_MODE,
+                        help="障害物との当たり判定の方式")
+    parser.add_argument("--bench", type=int, metavar="FRAMES", default=0,
+                        help="直列とパイプラインの描画速度を比較する")
+    parser.add_argument("--bench-collision", type=int, metavar="SEEDS", default=0,
+                        help="当たり判定の方式ごとに画面なしで自動プレイして速さを比較する")
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    COLLISION_MODE = args.collision
+    if args.convoy:
+        CONVOY_MODE = True
+    if args.bench_collision:
+        run_collision_benchmark(args.bench_collision)
+    elif args.bench:
+        run_benchmark(args.bench)
+    else:
+        main(pipelined=args.pipelined, fps=args.fps,
+             max_frames=args.frames, record=not args.no_record,
+             memdiag=args.memdiag, publish=args.publish, backend=args.backend,
+             versus=args.versus)
 
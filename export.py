@@ -0,0 +1,156 @@
+"""
+オフライン書き出し（トレーラー・回帰テスト用の動画）
+シード固定の自動プレイを画面なし（dummy ドライバ）で再生し、全フレームを書き出す。
+・フレームは共有メモリ上の枠に pg.image.frombuffer で直接描く（ピクセルのコピーなし）
+・PNG 連番はワーカープロセスのプールで並列に圧縮する
+・枠は画面と同じ BGRA 並びにして、描画時の形式変換をなくす
+・--raw なら BGRA の生フレームをそのままファイル/パイプに流す（ffmpeg 向け）
+同じシード・同じ操作なら毎回ビット単位で同じ画像になる。
+
+例:
+    python export.py --seed 42 --out frames/
+    python export.py --seed 42 --raw - | ffmpeg -f rawvideo -pix_fmt bgra \
+        -s 1100x650 -r 60 -i - out.mp4
+"""
+import os
+import sys
+import zlib
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import SuperRun
+import pygame as pg
+
+
+EXPORT_SLOTS = 8          # 共有メモリのフレーム枠数（圧縮待ちにできるフレーム数）
+EXPORT_PNG_LEVEL = 1      # PNG の zlib 圧縮レベル（小さいほど速い）
+FRAME_BYTES = SuperRun.WIDTH * SuperRun.HEIGHT * 4
+
+SIZE = (SuperRun.WIDTH, SuperRun.HEIGHT)
+
+_slots = []     # ワーカー側: 共有メモリの枠
+_frames = []    # ワーカー側: 枠をそのままピクセルにした Surface
+
+
+def write_png(path, rgb, w, h, level=EXPORT_PNG_LEVEL):
+    """RGB のピクセル列を PNG で保存する（メタデータなしなので中身が同じなら同じファイル）"""
+    stride = w * 3
+    rgb = memoryview(rgb)
+    raw = b"".join(b"\x00" + rgb[y * stride:(y + 1) * stride] for y in range(h))
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data +
+                struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, level)))
+        f.write(chunk(b"IEND", b""))
+
+
+def init_worker(names):
+    """ワーカー側で共有メモリの枠を開いておく"""
+    for name in names:
+        shm = shared_memory.SharedMemory(name=name)
+        _slots.append(shm)
+        _frames.append(pg.image.frombuffer(shm.buf[:FRAME_BYTES], SIZE, "BGRA"))
+
+
+def encode_png(slot, index, out_dir):
+    """枠 slot のフレームを PNG にする（ワーカー側）"""
+    path = os.path.join(out_dir, f"frame_{index:06d}.png")
+    write_png(path, pg.image.tobytes(_frames[slot], "RGB"), *SIZE)
+    return slot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="シード固定の自動プレイをフレーム書き出しする")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--policy", choices=sorted(SuperRun.POLICIES), default="scripted",
+                        help="自動プレイの操作方法")
+    parser.add_argument("--max-sec", type=float, default=180,
+                        help="書き出す最大の長さ（秒）")
+    parser.add_argument("--out", help="PNG 連番の出力ディレクトリ")
+    parser.add_argument("--raw", help="BGRA 生フレームの出力先（- で標準出力）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="PNG 圧縮のワーカープロセス数")
+    args = parser.parse_args(argv)
+    if not args.out and not args.raw:
+        parser.error("--out か --raw のどちらかを指定してください")
+
+    assets = SuperRun.init_headless()
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    raw = None
+    if args.raw:
+        raw = sys.stdout.buffer if args.raw == "-" else open(args.raw, "wb")
+
+    # 共有メモリの枠と、それをそのままピクセルにした Surface
+    shms = [shared_memory.SharedMemory(create=True, size=FRAME_BYTES)
+            for _ in range(EXPORT_SLOTS)]
+    surfaces = [pg.image.frombuffer(shm.buf[:FRAME_BYTES], SIZE, "BGRA") for shm in shms]
+    pending = [None] * EXPORT_SLOTS  # 枠ごとの圧縮中の Future
+    state = {"frames": 0, "world": None}
+
+    pool = None
+    if args.out:
+        pool = ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                   initargs=([shm.name for shm in shms],))
+
+    def emit(draw):
+        index = state["frames"]
+        slot = index % EXPORT_SLOTS
+        if pending[slot] is not None:
+            pending[slot].result()  # 前に使ったフレームの圧縮が終わるまで待つ
+            pending[slot] = None
+        surf = surfaces[slot]
+        draw(surf)
+        if raw is not None:
+            raw.write(shms[slot].buf[:FRAME_BYTES])
+        if pool is not None:
+            pending[slot] = pool.submit(encode_png, slot, index, args.out)
+        state["frames"] = index + 1
+
+    def on_frame(world, now):
+        state["world"] = world
+        emit(lambda surf: world.draw(surf, now))
+
+    try:
+        result = SuperRun.run_headless(assets, args.seed, args.policy, args.max_sec,
+                                       on_frame=on_frame)
+
+        # 終了画面も通常プレイと同じ長さだけ書き出す
+        world = state["world"]
+        if world is not None and not world.game_active:
+            end_frames = int(SuperRun.GAMEOVER_EXIT_DELAY_MS / SuperRun.FRAME_MS)
+            for k in range(end_frames):
+                now = world.end_time + int(k * SuperRun.FRAME_MS)
+
+                def draw(surf, now=now):
+                    world.draw(surf, now)
+                    SuperRun.draw_end_screen(surf, world, assets, None)
+                emit(draw)
+
+        for fut in pending:
+            if fut is not None:
+                fut.result()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if raw is not None and raw is not sys.stdout.buffer:
+            raw.close()
+        del surfaces[:]
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    print(f"{state['frames']} frames "
+          f"({state['frames'] * SuperRun.FRAME_MS / 1000.0:.1f}s of play) "
+          f"score={result['score']} cause={result['cause']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+観測リングの読み手の例（外部のボット）
+`python SuperRun.py --publish` で起動したゲームの状態を共有メモリから読み、
+前方の障害物が近づいたらジャンプを送り返す。終了時に遅延の統計を出す。
+    公開 → 読み取り : ゲームが書いてからボットが読むまで
+    公開 → 操作送信 : 読んで判断して操作を書き終えるまで（往復）
+"""
+import time
+import argparse
+
+import SuperRun as S
+
+
+def decide(obs):
+    """policy_scripted と同じ考え方で操作ビットを決める"""
+    reach = obs.world_speed * 14
+    right = obs.car_x + obs.car_w
+    for o in obs.obstacles:
+        if o.flags & S.OBS_DESTROYED:
+            continue
+        if 0 <= o.x - right < reach:
+            bits = S.ACT_JUMP if obs.on_ground else 0
+            if obs.destroy_count > 0:
+                bits |= S.ACT_SHIFT
+            return bits
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="観測リングを読んで操作するボット")
+    parser.add_argument("--name", default=S.OBS_SHM_NAME, help="共有メモリの名前")
+    parser.add_argument("--seconds", type=float, default=30, help="動かす時間（秒）")
+    args = parser.parse_args()
+
+    reader = S.ObsReader(args.name)
+    read_lat, rtt = [], []
+    last_bits = 0
+    end = time.perf_counter() + args.seconds
+    try:
+        while time.perf_counter() < end:
+            obs = reader.wait()
+            if obs is None:
+                continue
+            read_lat.append((time.perf_counter_ns() - obs.pub_ns) / 1e6)
+            if not obs.game_active:
+                break
+            bits = decide(obs)
+            if bits != last_bits or bits & S.ACT_JUMP:
+                reader.send(bits, obs.seq)
+                rtt.append((time.perf_counter_ns() - obs.pub_ns) / 1e6)
+                last_bits = bits
+    finally:
+        reader.close()
+
+    for name, values in (("公開→読み取り", read_lat), ("公開→操作送信", rtt)):
+        values.sort()
+        print(f"{name}: n={len(values)} "
+              f"p50={S.percentile(values, 0.5):.3f}ms p99={S.percentile(values, 0.99):.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+難易度パラメータのスイープ
+定数の組み合わせ（グリッド）ごとにシード固定の自動プレイを画面なしで何回も回し、
+生存時間・スコア・死因の分布を表や CSV にまとめる。
+プレイは ProcessPoolExecutor で全コアに分散する（プレイどうしは独立なのでほぼコア数に比例して速くなる）。
+
+例:
+    python sweep.py --grid SPEED_ACCEL=0.03,0.05,0.08 --grid JUMP_VELOCITY=-20,-22 \
+        --seeds 200 --policy scripted --csv sweep.csv
+    python sweep.py --grid COLLISION_MODE=rect,mask,swept --seeds 100
+"""
+import os
+import sys
+import csv
+import argparse
+import itertools
+import statistics
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import SuperRun
+
+
+# スイープ対象としてよく使う定数（それ以外も SuperRun の数値定数なら指定できる）
+SWEEP_PARAMS = [
+    "SPEED_ACCEL",
+    "SPAWN_INTERVAL_MS",
+    "STAR_SPAWN_INTERVAL_MS",
+    "JUMP_VELOCITY",
+    "EVENT_SPEED_UP",
+    "EVENT_SPEED_DOWN",
+    "COLLISION_MODE",
+]
+
+# 数値でない定数は選べる値を決めておく
+SWEEP_CHOICES = {
+    "COLLISION_MODE": SuperRun.COLLISION_MODES,
+}
+
+SEEDS_PER_TASK = 10  # 1タスクで回すプレイ数（小さすぎるとプロセス間通信が増える）
+
+_assets = None
+_defaults = {}
+
+
+def parse_grid(specs):
+    """["NAME=v1,v2", ...] → [(NAME, [v1, v2]), ...]（型は元の定数に合わせる）"""
+    grid = []
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        name = name.strip()
+        if not sep or not values:
+            raise SystemExit(f"--grid は NAME=v1,v2,... の形で指定してください: {spec}")
+        choices = SWEEP_CHOICES.get(name)
+        if choices is not None:
+            vals = [v.strip() for v in values.split(",")]
+            bad = [v for v in vals if v not in choices]
+            if bad:
+                raise SystemExit(f"{name} に使える値は {', '.join(choices)} です: {', '.join(bad)}")
+            grid.append((name, vals))
+            continue
+        default = getattr(SuperRun, name, None)
+        if isinstance(default, bool) or not isinstance(default, (int, float)):
+            raise SystemExit(f"{name} は SuperRun の数値定数ではありません")
+        cast = int if isinstance(default, int) else float
+        grid.append((name, [cast(v) for v in values.split(",")]))
+    return grid
+
+
+def init_worker(names):
+    """ワーカープロセスごとに1回：画面なしで pygame を初期化し、定数の初期値を覚える"""
+    global _assets
+    _assets = SuperRun.init_headless()
+    for name in names:
+        _defaults[name] = getattr(SuperRun, name)
+
+
+def run_task(params, seeds, policy, max_sec):
+    """params の定数でシードぶんプレイして結果のリストを返す（ワーカー側）"""
+    for name, value in _defaults.items():
+        setattr(SuperRun, name, params.get(name, value))
+    return [SuperRun.run_headless(_assets, seed, policy, max_sec) for seed in seeds]
+
+
+def summarize(results):
+    survival = [r["survival_ms"] / 1000.0 for r in results]
+    scores = [r["score"] for r in results]
+    return {
+        "runs": len(results),
+        "clear_rate": sum(r["cleared"] for r in results) / len(results),
+        "survival_mean": statistics.fmean(survival),
+        "survival_p50": statistics.median(survival),
+        "score_mean": statistics.fmean(scores),
+        "score_max": max(scores),
+        "causes": Counter(r["cause"] for r in results),
+    }
+
+
+def print_table(names, rows, causes):
+    head = names + ["runs", "clear%", "surv_avg", "surv_p50", "score_avg", "score_max"]
+    head += [f"{c}%" for c in causes]
+    widths = [max(len(h), 9) for h in head]
+    print("  ".join(h.rjust(w) for h, w in zip(head, widths)))
+    for params, st in rows:
+        cells = [str(params[n]) for n in names]
+        cells += [str(st["runs"]), f"{st['clear_rate'] * 100:.1f}",
+                  f"{st['survival_mean']:.1f}", f"{st['survival_p50']:.1f}",
+                  f"{st['score_mean']:.0f}", str(st["score_max"])]
+        cells += [f"{st['causes'][c] * 100 / st['runs']:.1f}" for c in causes]
+        print("  ".join(c.rjust(w) for c, w in zip(cells, widths)))
+
+
+def write_csv(path, names, rows, causes):
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(names + ["runs", "clear_rate", "survival_mean", "survival_p50",
+                            "score_mean", "score_max"] + [f"cause_{c}" for c in causes])
+        for params, st in rows:
+            w.writerow([params[n] for n in names] +
+                       [st["runs"], st["clear_rate"], st["survival_mean"],
+                        st["survival_p50"], st["score_mean"], st["score_max"]] +
+                       [st["causes"][c] for c in causes])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="難易度パラメータのスイープ（画面なし自動プレイ）")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=v1,v2,...",
+                        help="スイープする定数と値（複数指定で組み合わせ）。"
+                             "例: " + ", ".join(SWEEP_PARAMS))
+    parser.add_argument("--seeds", type=int, default=50, help="組み合わせごとのプレイ数")
+    parser.add_argument("--seed-base", type=int, default=0, help="最初のシード")
+    parser.add_argument("--policy", choices=sorted(SuperRun.POLICIES), default="scripted",
+                        help="自動プレイの操作方法")
+    parser.add_argument("--max-sec", type=float, default=SuperRun.HEADLESS_MAX_SEC,
+                        help="1プレイの打ち切り時間（秒）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="ワーカープロセス数（既定は全コア）")
+    parser.add_argument("--csv", help="結果を書き出す CSV ファイル")
+    args = parser.parse_args(argv)
+
+    grid = parse_grid(args.grid)
+    names = [n for n, _ in grid]
+    points = [dict(zip(names, combo))
+              for combo in itertools.product(*(vals for _, vals in grid))]
+    seeds = list(range(args.seed_base, args.seed_base + args.seeds))
+    chunks = [seeds[i:i + SEEDS_PER_TASK] for i in range(0, len(seeds), SEEDS_PER_TASK)]
+
+    results = [[] for _ in points]
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(names,)) as pool:
+        futures = [(k, pool.submit(run_task, params, chunk, args.policy, args.max_sec))
+                   for k, params in enumerate(points) for chunk in chunks]
+        for done, (k, fut) in enumerate(futures, 1):
+            results[k].extend(fut.result())
+            print(f"\r{done}/{len(futures)} tasks", end="", file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+
+    rows = [(params, summarize(res)) for params, res in zip(points, results)]
+    causes = sorted(set().union(*(st["causes"] for _, st in rows)))
+    print_table(names, rows, causes)
+    if args.csv:
+        write_csv(args.csv, names, rows, causes)
+
+
+if __name__ == "__main__":
+    main()